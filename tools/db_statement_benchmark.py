@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare the per-call cost of the traffic lookups of the db api.
+
+    tools/db_statement_benchmark.py [--rows N] [--calls N]
+                                    [--sql_connection URL]
+
+Fills the traffic_rules table and the former tqdisc and tfilter tables of
+the database (an in-memory sqlite one by default) with N rows and times N
+calls of the cached, compiled statements of traffic.db.sqlalchemy.api
+against the same queries built by string concatenation and run through a
+new session on the old tables, as they used to.
+"""
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                                os.pardir, os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'traffic', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('traffic', unicode=1)
+
+from traffic import context
+from traffic.db.sqlalchemy import api
+from traffic.db.sqlalchemy import models
+from traffic.db.sqlalchemy import session
+from traffic import flags
+
+FLAGS = flags.FLAGS
+
+
+def _old_classid(ctxt, instanceid):
+    return session.get_session().execute(
+        'select classid from tqdisc where instanceid ="' + instanceid +
+        '"').first()
+
+
+def _old_tfilter(ctxt, instanceid):
+    return session.get_session().execute(
+        'select * from tfilter where instanceid="' + instanceid +
+        '"').first()
+
+
+def _old_by_host(ctxt, host):
+    return session.get_session().execute(
+        'select * from tqdisc where host="' + host + '"').fetchall()
+
+
+def fill(rows):
+    engine = session.get_engine()
+    models.Tqdisc.__table__.create(engine, checkfirst=True)
+    models.Tfilter.__table__.create(engine, checkfirst=True)
+    models.TrafficRule.__table__.create(engine, checkfirst=True)
+    engine.execute(models.TrafficRule.__table__.insert(),
+                   [{'instanceid': 'instance-%d' % i,
+                     'classid': '10:%x' % (0x11 + i),
+                     'host': 'host-%d' % (i % 10),
+                     'handle': (1 << 20) + i,
+                     'ip': '10.%d.%d.%d' % (i >> 16, (i >> 8) & 0xff,
+                                            i & 0xff),
+                     'band': '5Mbit',
+                     'prio': 1} for i in xrange(rows)])
+    engine.execute(models.Tqdisc.__table__.insert(),
+                   [{'instanceid': 'instance-%d' % i,
+                     'classid': '10:%x' % (0x11 + i),
+                     'host': 'host-%d' % (i % 10),
+                     'ip': '10.%d.%d.%d' % (i >> 16, (i >> 8) & 0xff,
+                                            i & 0xff),
+                     'band': '5Mbit',
+                     'prio': 1} for i in xrange(rows)])
+    engine.execute(models.Tfilter.__table__.insert(),
+                   [{'instanceid': 'instance-%d' % i,
+                     'classid': '10:%x' % (0x11 + i),
+                     'flowid': '10:%x' % (0x11 + i),
+                     'host': 'host-%d' % (i % 10),
+                     'handle': (1 << 20) + i,
+                     'ip': '10.%d.%d.%d' % (i >> 16, (i >> 8) & 0xff,
+                                            i & 0xff),
+                     'prio': 1} for i in xrange(rows)])
+
+
+def run(name, function, ctxt, args):
+    start = time.time()
+    for arg in args:
+        function(ctxt, arg)
+    elapsed = time.time() - start
+    print '%-28s %8.1f us/call' % (name, elapsed * 1e6 / len(args))
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('--rows', type='int', default=1000)
+    optparser.add_option('--calls', type='int', default=5000)
+    optparser.add_option('--sql_connection', default='sqlite://')
+    options, _args = optparser.parse_args()
+    FLAGS([sys.argv[0]])
+    FLAGS.set_override('sql_connection', options.sql_connection)
+
+    fill(options.rows)
+    ctxt = context.get_admin_context()
+    instances = ['instance-%d' % (i % options.rows)
+                 for i in xrange(options.calls)]
+    hosts = ['host-%d' % (i % 10) for i in xrange(options.calls // 10)]
+
+    run('classid by instance (old)', _old_classid, ctxt, instances)
+    run('classid by instance', api.get_classid_by_instance, ctxt, instances)
+    run('tfilter by instance (old)', _old_tfilter, ctxt, instances)
+    run('tfilter by instance', api.tfilter_get_by_instance, ctxt, instances)
+    run('rule by instance', api.traffic_rule_get_by_instance, ctxt,
+        instances)
+    run('tqdisc by host (old)', _old_by_host, ctxt, hosts)
+    run('tqdisc by host', api.tqdisc_get_all_by_host, ctxt, hosts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark traffic.rootwrap.wrapper.match_filter on synthetic filters.
+
+    tools/rootwrap_filter_benchmark.py [--commands N] [--repeat N]
+
+Builds N filters (400 by default) over N / 8 commands, a third of them
+regexp filters in the shape of the tc filters, and reports the match rate
+of tc commands against the plain filter list and against its FilterIndex.
+"""
+
+import optparse
+import os
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                                os.pardir, os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'traffic', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from traffic.rootwrap import filters
+from traffic.rootwrap import wrapper
+
+
+def build_filters(count):
+    filterlist = []
+    for index in xrange(count):
+        name = 'cmd%d' % (index % max(count // 8, 1))
+        if index % 3:
+            filterlist.append(filters.CommandFilter('/usr/bin/' + name,
+                                                    'root'))
+        else:
+            filterlist.append(filters.RegExpFilter(
+                '/usr/bin/' + name, 'root', name, 'class', 'add', 'dev',
+                'eth[0-9]+', 'parent', '10:1', 'classid', '10:[0-9a-f]+'))
+    filterlist.append(filters.KillFilter('root', '/usr/sbin/dnsmasq'))
+    filterlist.append(filters.RegExpFilter(
+        '/sbin/tc', 'root', 'tc', 'class', '(add|change)', 'dev', '[a-z0-9]+',
+        'parent', '10:1', 'classid', '10:[0-9a-f]+', 'htb', 'rate',
+        '[0-9]+[kmg]?bit'))
+    filterlist.append(filters.CommandFilter('/sbin/tc', 'root'))
+    return filterlist
+
+
+COMMANDS = [
+    ['tc', 'class', 'add', 'dev', 'eth0', 'parent', '10:1', 'classid',
+     '10:11', 'htb', 'rate', '5mbit'],
+    ['tc', 'filter', 'del', 'dev', 'eth0', 'parent', '10:', 'prio', '1'],
+    ['tc', '-batch', '-'],
+]
+
+
+def run(name, filterlist, repeat):
+    best = None
+    for _i in xrange(repeat):
+        start = time.time()
+        for _j in xrange(1000):
+            for userargs in COMMANDS:
+                if wrapper.match_filter(filterlist, userargs) is None:
+                    raise AssertionError('%s denied' % ' '.join(userargs))
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    matches = 1000 * len(COMMANDS)
+    print '%-8s %5d filters  %7.3fs  %9.0f matches/s' % (
+        name, len(filterlist), best, matches / best)
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('--commands', type='int', default=400)
+    optparser.add_option('--repeat', type='int', default=3)
+    options, _args = optparser.parse_args()
+
+    filterlist = build_filters(options.commands)
+    run('list', filterlist, options.repeat)
+    run('index', wrapper.FilterIndex(filterlist), options.repeat)
+
+
+if __name__ == '__main__':
+    main()
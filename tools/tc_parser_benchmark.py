@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark traffic.tqdisc.parser on synthetic tc dumps.
+
+    tools/tc_parser_benchmark.py [--classes N] [--repeat N]
+
+Generates a ``tc -s -d class show`` and a ``tc filter show`` dump of N
+classes (10000 by default) and reports the parse rate.  The dumps are
+produced lazily so that the memory reported is the parser's own.
+"""
+
+import optparse
+import os
+import resource
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                                os.pardir, os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'traffic', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from traffic.tqdisc import parser
+
+
+def class_dump(count):
+    yield ('class htb 10:1 root rate 1Gbit ceil 1Gbit linklayer ethernet '
+           'burst 1375b/1 mpu 0b cburst 1375b/1 mpu 0b level 7 \n')
+    yield ' Sent 912837 bytes 8811 pkt (dropped 0, overlimits 0 requeues 0) \n'
+    yield ' backlog 0b 0p requeues 0\n'
+    yield ' lended: 0 borrowed: 0 giants: 0\n'
+    yield ' tokens: 187 ctokens: 187\n'
+    yield '\n'
+    for minor in xrange(0x11, 0x11 + count):
+        yield ('class htb 10:%x parent 10:1 prio 1 quantum 62500 rate %dMbit '
+               'ceil %dMbit linklayer ethernet burst 1600b/1 mpu 0b cburst '
+               '1600b/1 mpu 0b level 0 \n' % (minor, minor % 100 + 1,
+                                              minor % 100 + 1))
+        yield (' Sent %d bytes %d pkt (dropped %d, overlimits %d requeues 0) '
+               '\n' % (minor * 1500, minor, minor % 7, minor % 13))
+        yield ' backlog 0b 0p requeues 0\n'
+        yield ' lended: %d borrowed: 0 giants: 0\n' % minor
+        yield ' tokens: 50000 ctokens: 50000\n'
+        yield '\n'
+
+
+def filter_dump(count):
+    yield 'filter parent 10: protocol ip pref 1 u32 chain 0 \n'
+    tables = (count + 255) // 256
+    for htid in xrange(1, tables + 1):
+        yield ('filter parent 10: protocol ip pref 1 u32 chain 0 fh %x: ht '
+               'divisor 256 \n' % htid)
+    for index in xrange(count):
+        htid, octet = index // 256 + 1, index % 256
+        yield ('filter parent 10: protocol ip pref 1 u32 chain 0 fh %x:%x:1 '
+               'order 1 key ht %x bkt %x *flowid 10:%x not_in_hw \n'
+               % (htid, octet, htid, octet, index + 0x11))
+        yield '  match 0a%04x%02x/ffffffff at 12\n' % (htid, octet)
+    yield ('filter parent 10: protocol ip pref 1 u32 chain 0 fh 800: ht '
+           'divisor 1 \n')
+    for htid in xrange(1, tables + 1):
+        yield ('filter parent 10: protocol ip pref 1 u32 chain 0 fh 800::%x '
+               'order %d key ht 800 bkt 0 link %x: not_in_hw \n'
+               % (htid, htid, htid))
+        yield '  match 0a%04x00/ffffff00 at 12\n' % htid
+        yield '    hash mask 000000ff at 12 \n'
+
+
+def run(name, parse, dump, count, repeat):
+    lines = sum(1 for _line in dump(count))
+    best = None
+    for _i in xrange(repeat):
+        start = time.time()
+        records = 0
+        for _record in parse(dump(count)):
+            records += 1
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print '%-8s %6d records %7d lines  %7.3fs  %9.0f lines/s' % (
+        name, records, lines, best, lines / best)
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('--classes', type='int', default=10000)
+    optparser.add_option('--repeat', type='int', default=3)
+    options, _args = optparser.parse_args()
+
+    run('classes', parser.parse_classes, class_dump, options.classes,
+        options.repeat)
+    run('filters', parser.parse_filters, filter_dump, options.classes,
+        options.repeat)
+    print 'max rss %d KiB' % resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+
+
+if __name__ == '__main__':
+    main()
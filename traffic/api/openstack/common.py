@@ -28,11 +28,24 @@ from traffic.api.openstack import xmlutil
 from traffic.compute import utils as compute_utils 
 from traffic import exception
 from traffic import flags
+from traffic.openstack.common import cfg
 from traffic.openstack.common import log as logging
 
 
+osapi_opts = [
+    cfg.IntOpt('osapi_max_limit',
+               default=1000,
+               help='the maximum number of items returned in a single '
+                    'response from a collection resource'),
+    cfg.StrOpt('osapi_compute_link_prefix',
+               default=None,
+               help='Base URL that will be presented to users in links '
+                    'to the OpenStack Compute API'),
+    ]
+
 LOG = logging.getLogger(__name__)
 FLAGS = flags.FLAGS
+FLAGS.register_opts(osapi_opts)
 
 
 XML_NS_V11 = 'http://docs.openstack.org/compute/api/v1.1'
@@ -76,6 +89,14 @@ def _get_page_index_param(request):
 
 
 
+def get_limit_and_marker(request, max_limit=None):
+    """Return the limit, capped to max_limit, and marker of a request."""
+    params = get_pagination_params(request)
+    max_limit = max_limit or FLAGS.osapi_max_limit
+    limit = min(params.get('limit') or max_limit, max_limit)
+    return limit, params.get('marker')
+
+
 def _get_limit_param(request):
     """Extract integer limit from request or fail"""
     try:
@@ -314,10 +335,16 @@ class ViewBuilder(object):
                               request,
                               items,
                               collection_name,
-                              id_key="uuid"):
-        """Retrieve 'next' link, if applicable."""
+                              id_key="uuid",
+                              limit=None):
+        """Retrieve 'next' link, if applicable.
+
+        limit is the number of items the page was read with, by default
+        the one get_limit_and_marker derives from the request.
+        """
         links = []
-        limit = int(request.params.get("limit", 0))
+        if limit is None:
+            limit, _marker = get_limit_and_marker(request)
         if limit and limit == len(items):
             last_item = items[-1]
             if id_key in last_item:
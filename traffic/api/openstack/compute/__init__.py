@@ -61,7 +61,8 @@ class APIRouter(traffic.api.openstack.APIRouter):
         self.resources['traffic'] = trafficapi.create_resource()
         mapper.resource("traffic", "traffic",
                         controller=self.resources['traffic'],
-                        collection={'list':'GET', 'create':'POST', 'delete':'POST', 'show':'POST'},
+                        collection={'list':'GET', 'create':'POST', 'delete':'POST', 'show':'POST',
+                                    'cache_stats': 'GET'},
                         member={'action':'POST'})
         
         controller = self.resources['traffic']
@@ -88,3 +89,15 @@ class APIRouter(traffic.api.openstack.APIRouter):
                        controller=controller,
                        action='show_by_ip',
                        conditions={"show_by_ip":'POST'})
+
+        mapper.connect("traffic",
+                       "/{project_id}/traffic/stats/{instance_id}",
+                       controller=controller,
+                       action='stats',
+                       conditions={"method": 'GET'})
+
+        mapper.connect("traffic",
+                       "/{project_id}/traffic/bulk",
+                       controller=controller,
+                       action='bulk',
+                       conditions={"method": 'POST'})
@@ -6,6 +6,7 @@ from traffic.api.openstack import wsgi
 from traffic.api.openstack import xmlutil
 from traffic import flags
 from traffic import compute
+from traffic import utils
 from traffic.openstack.common import log as logging
 
 from traffic.api.openstack.compute.viewer import tqdisc
@@ -36,6 +37,34 @@ class Controller(wsgi.Controller):
         prio = body['prio']
         self._compute_api.create(context, instance_id, band, prio)
     
+    def bulk(self, req, body):
+        context = req.environ['traffic.context']
+        try:
+            traffics = [{'instance_id': item['instance_id'],
+                         'band': item['band'],
+                         'prio': item.get('prio', 1)}
+                        for item in body['traffics']]
+        except (KeyError, TypeError, AttributeError):
+            msg = _('traffics must be a list of instance_id, band and prio')
+            raise exc.HTTPBadRequest(explanation=msg)
+        try:
+            hosts = self._compute_api.create_bulk(context, traffics)
+        except traffic.exception.NotFound as e:
+            raise exc.HTTPNotFound(explanation=unicode(e))
+        return {'traffics': len(traffics), 'hosts': hosts}
+
+    def update(self, req, id, body):
+        context = req.environ['traffic.context']
+        try:
+            band = body['band']
+        except (KeyError, TypeError):
+            msg = _('band is required')
+            raise exc.HTTPBadRequest(explanation=msg)
+        try:
+            self._compute_api.update(context, id, band, body.get('prio'))
+        except traffic.exception.NotFound as e:
+            raise exc.HTTPNotFound(explanation=unicode(e))
+
     def delete(self, req, body):
         instance_id = body['instance_id']
         context = req.environ['traffic.context']
@@ -59,17 +88,49 @@ class Controller(wsgi.Controller):
     
     def list(self, req):
         context = req.environ['traffic.context']
-        result = self._compute_api.list(context)
-         
+        limit, marker = common.get_limit_and_marker(req)
+        filters = dict((key, req.GET[key]) for key in ('host', 'ip', 'band')
+                       if key in req.GET)
+        if utils.bool_from_str(req.GET.get('stream')):
+            # the whole listing, written out as it is read
+            traffics = self._compute_api.list_iter(context, filters)
+            return wsgi.StreamingResponseObject(
+                'traffics', (self._view_builder.basic(req, t)['traffic']
+                             for t in traffics))
+        try:
+            result = self._compute_api.list(context, filters=filters,
+                                            limit=limit, marker=marker)
+        except traffic.exception.MarkerNotFound as e:
+            raise exc.HTTPBadRequest(explanation=unicode(e))
+
         if not result:
             return {'traffics':{}}
-        response = self._view_builder.index(req, result)
+        response = self._view_builder.index(req, result, limit=limit)
         return response
     
     def show_by_ip(self, req, ip, body):
         context = req.environ['traffic.context']
         band = self._compute_api.get_by_ip(context, ip)
         return band
+
+    def stats(self, req, instance_id):
+        context = req.environ['traffic.context']
+        window = req.GET.get('window')
+        try:
+            window = int(window) if window else None
+        except ValueError:
+            msg = _('window must be a number of seconds')
+            raise exc.HTTPBadRequest(explanation=msg)
+        try:
+            stats = self._compute_api.get_stats(context, instance_id, window)
+        except traffic.exception.NotFound:
+            msg = _('No traffic statistics for instance %s') % instance_id
+            raise exc.HTTPNotFound(explanation=msg)
+        return {'stats': stats}
+
+    def cache_stats(self, req):
+        return {'network_cache': self._compute_api.network_cache_stats()}
+
 def create_resource():
     
     return wsgi.Resource(Controller())
@@ -10,7 +10,8 @@ LOG = logging.getLogger(__name__)
 
 class ViewBuilder(common.ViewBuilder):
     
-    _collection_name = 'tqdisc'
+    # the next links point back at the list action
+    _collection_name = 'traffic/list'
     
     def basic(self, request, traffic):
         """Generic, non-detailed view of an instance."""
@@ -28,15 +29,16 @@ class ViewBuilder(common.ViewBuilder):
     def show(self):
         return
     
-    def index(self, request, traffics):
-        return self._list_view(self.basic, request, traffics)
+    def index(self, request, traffics, limit=None):
+        return self._list_view(self.basic, request, traffics, limit)
     
-    def _list_view(self, func, request, traffics):
+    def _list_view(self, func, request, traffics, limit=None):
         """Provide a view for a list of servers."""
         traffic_list = [func(request, traffic)["traffic"] for traffic in traffics]
         traffic_links = self._get_collection_links(request,
                                                    traffics,
-                                                   self._collection_name)
+                                                   self._collection_name,
+                                                   limit=limit)
         traffics_dict = dict(traffics=traffic_list)
 
         if traffic_links:
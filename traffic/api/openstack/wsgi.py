@@ -603,6 +603,50 @@ class ResponseObject(object):
         return self._headers.copy()
 
 
+class StreamingResponseObject(ResponseObject):
+    """A response object whose list is serialized as it is sent.
+
+    items is an iterable of dicts returned as the key list of the body.
+    For JSON they are written chunk_size at a time through the WSGI
+    iterator of the response, so that the list is never held in memory as
+    a whole; other content types get the whole list serialized as usual.
+    """
+
+    def __init__(self, key, items, chunk_size=100, **kwargs):
+        super(StreamingResponseObject, self).__init__(None, **kwargs)
+        self.key = key
+        self.items = items
+        self.chunk_size = chunk_size
+
+    def _iter_json(self):
+        yield '{%s: [' % jsonutils.dumps(self.key)
+        separator = ''
+        chunk = []
+        for item in self.items:
+            chunk.append(jsonutils.dumps(item))
+            if len(chunk) >= self.chunk_size:
+                yield separator + ', '.join(chunk)
+                separator = ', '
+                chunk = []
+        if chunk:
+            yield separator + ', '.join(chunk)
+        yield ']}'
+
+    def serialize(self, request, content_type, default_serializers=None):
+        if _MEDIA_TYPE_MAP.get(content_type, content_type) != 'json':
+            self.obj = {self.key: list(self.items)}
+            return super(StreamingResponseObject, self).serialize(
+                request, content_type, default_serializers)
+
+        response = webob.Response()
+        response.status_int = self.code
+        for hdr, value in self._headers.items():
+            response.headers[hdr] = value
+        response.headers['Content-Type'] = content_type
+        response.app_iter = self._iter_json()
+        return response
+
+
 def action_peek_json(body):
     """Determine action to invoke."""
 
@@ -1,6 +1,7 @@
 '#################################################################'
 import base64
 import functools
+import os
 import re
 import string
 import time
@@ -19,15 +20,114 @@ from traffic.openstack.common import excutils
 from traffic.openstack.common import importutils
 from traffic.openstack.common import jsonutils
 from traffic.openstack.common import log as logging
+from traffic.openstack.common import rpc
 from traffic.openstack.common import timeutils
 from traffic.openstack.common.gettextutils import _
 from traffic import tqdisc
+from traffic.tqdisc import parser
 from traffic import tfilter
 from traffic.scheduler import rpcapi as scheduler_rpcapi 
 from traffic import utils
 from traffic.openstack.common import cfg
 
 
+LOG = logging.getLogger(__name__)
+
+network_cache_opts = [
+    cfg.IntOpt('instance_network_cache_size',
+               default=10000,
+               help='Number of instances whose host, mac and ip are cached '
+                    'by the api. Set to 0 to disable the cache.'),
+    cfg.IntOpt('instance_network_cache_ttl',
+               default=300,
+               help='Seconds an instance stays in the network cache'),
+    cfg.BoolOpt('instance_network_cache_notifications',
+                default=True,
+                help='Drop instances from the network cache on the instance '
+                     'and floating ip notifications'),
+    cfg.StrOpt('instance_network_cache_exchange',
+               default='nova',
+               help='Exchange the instance and floating ip notifications '
+                    'are published on'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(network_cache_opts)
+FLAGS.import_opt('notification_topics',
+                 'traffic.openstack.common.notifier.rabbit_notifier')
+
+_NETWORK_CACHE = None
+_NETWORK_CACHE_LISTENER = None
+
+
+def get_network_cache():
+    """Return the instance -> {'host', 'mac', 'ip'} cache of the process."""
+    global _NETWORK_CACHE
+    if _NETWORK_CACHE is None:
+        _NETWORK_CACHE = utils.LRUCache(FLAGS.instance_network_cache_size,
+                                        FLAGS.instance_network_cache_ttl)
+    return _NETWORK_CACHE
+
+
+class NetworkCacheListener(object):
+    """Drop stale entries of the network cache on notifications.
+
+    Instances are dropped on any compute.instance.* notification, which
+    covers updates, migrations and deletes, and on floating ip
+    (dis)association of their address.  The ttl of the cache bounds the
+    staleness of whatever notification is missed.  Every api worker has a
+    queue of its own, deleted with its connection, so that each of them
+    sees every notification.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.conn = None
+
+    def start(self):
+        self.conn = rpc.create_connection(new=True)
+        for topic in FLAGS.notification_topics:
+            topic = '%s.info' % topic
+            self.conn.declare_topic_consumer(
+                topic, self.process,
+                queue_name='%s.network_cache.%s.%d' % (topic, FLAGS.host,
+                                                       os.getpid()),
+                exchange_name=FLAGS.instance_network_cache_exchange,
+                exclusive=True)
+        self.conn.consume_in_thread()
+
+    def process(self, message):
+        event_type = message.get('event_type') or ''
+        payload = message.get('payload') or {}
+        if event_type.startswith('compute.instance.'):
+            instance_id = payload.get('instance_id')
+            if instance_id:
+                self.cache.pop(instance_id)
+        elif event_type.startswith('network.floating_ip.'):
+            address = payload.get('floating_ip')
+            for instance_id, info in self.cache.items():
+                if info['ip'] == address:
+                    self.cache.pop(instance_id)
+
+
+def _start_network_cache_listener(cache):
+    """Start listening to notifications, once per process.
+
+    Started on first use rather than at import so that every api worker
+    gets its own connection after the fork.
+    """
+    global _NETWORK_CACHE_LISTENER
+    if (_NETWORK_CACHE_LISTENER is not None or cache.maxsize <= 0 or
+            not FLAGS.instance_network_cache_notifications):
+        return
+    _NETWORK_CACHE_LISTENER = NetworkCacheListener(cache)
+    try:
+        _NETWORK_CACHE_LISTENER.start()
+    except Exception:
+        LOG.exception(_('Failed to listen to notifications, the network '
+                        'cache relies on its ttl only'))
+
+
 class API(base.Base):
     
     def __init__(self, image_service=None, tqdisc_api=None, tfilter_api=None,
@@ -36,58 +136,130 @@ class API(base.Base):
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
         self.tqdisc_api = tqdisc_api or tqdisc.API()
         self.tfilter_api = tfilter_api or tfilter.API()
+        self.network_cache = get_network_cache()
             
         super(API, self).__init__(**kwargs)
 
          
+    def _network_info(self, infos, instance_id, need_ip=True):
+        """Return the host, mac and ip of an instance out of infos."""
+        info = infos.get(instance_id)
+        if not info or not info['host']:
+            raise exception.InstanceNotFound(instance_id=instance_id)
+        if need_ip and not info['ip']:
+            raise exception.FixedIpNotFoundForInstance(
+                instance_uuid=instance_id)
+        return info
+
+    def get_network_infos(self, context, instance_ids):
+        """Return {instance_id: info} through the network cache."""
+        _start_network_cache_listener(self.network_cache)
+        infos = {}
+        missing = []
+        for instance_id in instance_ids:
+            info = self.network_cache.get(instance_id)
+            if info is None:
+                missing.append(instance_id)
+            else:
+                infos[instance_id] = info
+        if missing:
+            found = self.db.instance_network_info_get_many(context, missing)
+            for instance_id, info in found.iteritems():
+                # an instance not scheduled yet is not worth keeping
+                if info['host']:
+                    self.network_cache.set(instance_id, info)
+            infos.update(found)
+        return infos
+
+    def get_network_info(self, context, instance_id, need_ip=True):
+        infos = self.get_network_infos(context, [instance_id])
+        return self._network_info(infos, instance_id, need_ip)
+
+    def network_cache_stats(self):
+        return self.network_cache.stats()
+
     def create(self, context, instance_id, band, prio):
-#         compute_rpcapi.create_traffic(context, ip, instance_id, band, prio)
-        #self.compute_rpcapi.create_traffic(context, ip, instance_id, band, prio)
-        ip = self.get_ip_by_instance(context, instance_id)
-        host = self.get_host_by_instance(context, instance_id)
-        mac = self.get_mac_by_instance(context, instance_id)
-        self.scheduler_rpcapi.create_traffic(context, ip.first()[0], instance_id, band, host[0], mac[0], prio)
-        
+        info = self.get_network_info(context, instance_id)
+        self.scheduler_rpcapi.create_traffic(context, info['ip'], instance_id,
+                                             band, info['host'], info['mac'],
+                                             prio)
+
+    def create_bulk(self, context, traffics):
+        """Create the traffic of many instances, one cast per host.
+
+        traffics is a list of dicts with instance_id, band and prio keys.
+        """
+        infos = self.get_network_infos(
+            context, [traffic['instance_id'] for traffic in traffics])
+        by_host = {}
+        for traffic in traffics:
+            info = self._network_info(infos, traffic['instance_id'])
+            by_host.setdefault(info['host'], []).append(
+                {'instance_id': traffic['instance_id'],
+                 'band': traffic['band'],
+                 'prio': traffic['prio'],
+                 'ip': info['ip'],
+                 'mac': info['mac']})
+        for host, items in by_host.iteritems():
+            self.compute_rpcapi.create_traffic_bulk(context, items, host)
+        return dict((host, len(items)) for host, items in by_host.iteritems())
+
     def show(self, context, instance_id):
         results = self.tqdisc_api.get_by_instance_id(context, instance_id)
         result = results.first()
         traffic = {'id':result[0], 'instanceid':result[5], 'ip':result[7], 'host':result[8], 'band':result[9]}
         return traffic
     
-    def list(self, context):
-        results = self.tqdisc_api.get_all(context)
-        traffics = []
-        for result in results:
-#            traffic = dict(result.iteritems())
-            traffic = {'id':result[0], 'instanceid':result[5], 'ip':result[7], 'host':result[8], 'band':result[9]}
-            traffics.append(traffic)
-        return traffics
-        
+    def list(self, context, filters=None, limit=None, marker=None):
+        """Return a page of traffics, see db.tqdisc_get_all_by_filters."""
+        results = self.tqdisc_api.get_all(context, self._filters(filters),
+                                          limit, marker)
+        return [self._traffic(result) for result in results]
+
+    def list_iter(self, context, filters=None):
+        """Yield every traffic matching filters, for exports."""
+        for result in self.tqdisc_api.get_all_iter(context,
+                                                   self._filters(filters)):
+            yield self._traffic(result)
+
+    def _filters(self, filters):
+        filters = dict(filters or {})
+        band = filters.get('band')
+        if band and band.isdigit():
+            # bands are stored with their unit, as create() writes them
+            filters['band'] = parser.format_band(band)
+        return filters
+
+    def _traffic(self, result):
+        return {'id': result['id'],
+                'instanceid': result['instanceid'],
+                'ip': result['ip'],
+                'host': result['host'],
+                'band': result['band']}
+
+    def get_stats(self, context, instance_id, window=None):
+        info = self.get_network_info(context, instance_id, need_ip=False)
+        return self.compute_rpcapi.get_traffic_stats(context, instance_id,
+                                                     window, info['host'])
+
     def get_by_ip(self, context, ip):
-        tfilter = self.tfilter_api.get_by_ip(context, ip)
-        result = self.tqdisc_api.get_by_classid(context, tfilter["flow_id"])
-        return result["band"]
+        return self.tqdisc_api.get_by_ip(context, ip)['band']
         
     def delete(self, context, instance_id):
-        host = self.get_host_by_instance(context, instance_id)    
-        mac = self.get_mac_by_instance(context, instance_id)
-        self.scheduler_rpcapi.delete_traffic(context, instance_id, host[0], mac[0])
+        info = self.get_network_info(context, instance_id, need_ip=False)
+        self.scheduler_rpcapi.delete_traffic(context, instance_id,
+                                             info['host'], info['mac'])
         
-    def delete_bk(self, context, instance_id):
-        result = self.tqdisc_api.get_by_instance_id(context, instance_id)
-        self.tqdisc_api.delete(context, result["classid"])
-        tfilter = self.tfilter_api.get(context, result["classid"])
-        self.tfilter_api.delete(context, tfilter["handle"], tfilter['prio'])
-            
     def delete_by_ip(self, context, ip):
         result = self.tqdisc_api.get_by_ip(context, ip)
         self.tqdisc_api.delete_by_ip(context, result['classid'])
         tfilter = self.tfilter_api.get(context, result['classid'])
         self.tfilter_api.delete(context, tfilter['handle'], tfilter['prio'])
         
-    def update(self, context, server_id, band):
-        self.delete(context, server_id)
-        self.create(context, server_id, band)
+    def update(self, context, instance_id, band, prio=None):
+        info = self.get_network_info(context, instance_id, need_ip=False)
+        self.scheduler_rpcapi.update_traffic(context, instance_id, band, prio,
+                                             info['host'])
         
     def get_ip_by_instance(self, context, instanceid):
         return self.db.get_ip_by_instance(context, instanceid)
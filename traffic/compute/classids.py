@@ -0,0 +1,167 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Allocation of htb class ids on the interfaces of this host.
+
+Every interface gets a bitmap of the 16 bit minors under its htb root.
+Freed minors are queued for reuse and new ones are taken from a moving
+cursor, so both allocate and free are O(1).  The bitmaps live in memory
+only: they are seeded from the traffic rules of this host and from the
+classes in the kernel when the agent starts, which also gives back the
+minors a crash leaked.
+
+tc reads the minor of a classid as hex, so ids are rendered as such.
+"""
+
+import collections
+import re
+
+from traffic.compute import executor
+from traffic import db
+from traffic import exception
+from traffic import flags
+from traffic.openstack.common import log as logging
+from traffic import utils
+
+
+LOG = logging.getLogger(__name__)
+
+FLAGS = flags.FLAGS
+
+MAX_MINOR = 0xffff
+
+# 10:1 is the parent of every instance class and 10:10 the default class
+RESERVED_MINORS = 0x10
+
+_CLASS_RE = re.compile(r'^class \S+ ([0-9a-f]+):([0-9a-f]+)\s')
+
+
+def parse_classid(classid):
+    """Split 'major:minor' into the major string and the integer minor."""
+    major, _sep, minor = classid.partition(':')
+    return major, int(minor, 16)
+
+
+class ClassIdAllocator(object):
+    """Bitmap of the minors in use under one htb root qdisc."""
+
+    def __init__(self, major='10'):
+        self.major = major
+        self._bits = bytearray((MAX_MINOR + 1) // 8)
+        self._free = collections.deque()
+        self._cursor = RESERVED_MINORS + 1
+        for minor in xrange(RESERVED_MINORS + 1):
+            self._set(minor)
+
+    def _set(self, minor):
+        self._bits[minor >> 3] |= 1 << (minor & 7)
+
+    def in_use(self, minor):
+        return bool(self._bits[minor >> 3] & (1 << (minor & 7)))
+
+    def mark(self, minor):
+        """Record a minor that is already taken."""
+        if 0 <= minor <= MAX_MINOR:
+            self._set(minor)
+
+    def allocate(self):
+        """Take a free minor and return it as a classid string."""
+        # freed minors first, oldest first, so a minor whose class delete
+        # is still pending is not handed out again straight away
+        while self._free:
+            minor = self._free.popleft()
+            if not self.in_use(minor):
+                self._set(minor)
+                return '%s:%x' % (self.major, minor)
+        while self._cursor <= MAX_MINOR:
+            minor = self._cursor
+            self._cursor += 1
+            if not self.in_use(minor):
+                self._set(minor)
+                return '%s:%x' % (self.major, minor)
+        raise exception.NoMoreClassIds(major=self.major)
+
+    def free(self, classid):
+        """Give back a classid returned by allocate()."""
+        major, minor = parse_classid(classid)
+        if major != self.major or minor <= RESERVED_MINORS or \
+                minor > MAX_MINOR or not self.in_use(minor):
+            return
+        self._bits[minor >> 3] &= ~(1 << (minor & 7)) & 0xff
+        self._free.append(minor)
+
+
+class ClassIdPool(object):
+    """The allocators of all interfaces of this host."""
+
+    def __init__(self, execute=None):
+        self._execute = execute or executor.get_executor().execute
+        self._allocators = {}
+        # seeding runs tc, concurrent first users of an interface wait for
+        # the one seeding it
+        self._seeding = utils.KeyedLock()
+
+    def _seed(self, context, interface, major):
+        """Build the bitmap of an interface from the db and the kernel."""
+        allocator = ClassIdAllocator(major)
+        for row in db.tqdisc_get_classids_by_host(context, FLAGS.host):
+            try:
+                row_major, minor = parse_classid(row[0])
+            except (AttributeError, ValueError):
+                # rows of ingress policers carry no classid
+                continue
+            if row_major == major:
+                allocator.mark(minor)
+        out, _err = self._execute('tc', 'class', 'show', 'dev', interface,
+                                  run_as_root=True, check_exit_code=False)
+        for line in out.splitlines():
+            match = _CLASS_RE.match(line)
+            if match and match.group(1) == major:
+                allocator.mark(int(match.group(2), 16))
+        LOG.info(_('Seeded htb class ids of %s from the database and the '
+                   'kernel'), interface)
+        return allocator
+
+    def get_allocator(self, context, interface, major='10'):
+        """Return the allocator of interface, seeding it if needed."""
+        allocator = self._allocators.get(interface)
+        if allocator is None or allocator.major != major:
+            with self._seeding.lock(interface):
+                allocator = self._allocators.get(interface)
+                if allocator is None or allocator.major != major:
+                    allocator = self._seed(context, interface, major)
+                    self._allocators[interface] = allocator
+        return allocator
+
+    def allocate(self, context, interface, major='10'):
+        """Return a free classid under the htb root of interface."""
+        return self.get_allocator(context, interface, major).allocate()
+
+    def free(self, context, interface, classid):
+        """Release a classid of interface."""
+        if not classid or ':' not in classid:
+            return
+        major, _minor = parse_classid(classid)
+        self.get_allocator(context, interface, major).free(classid)
+
+
+_POOL = None
+
+
+def get_pool():
+    """Return the process wide class id pool."""
+    global _POOL
+    if _POOL is None:
+        _POOL = ClassIdPool()
+    return _POOL
@@ -0,0 +1,141 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Shared executor of the commands programming the kernel.
+
+Every tc process of the compute agent (batch flushes, class and filter
+dumps, stats sweeps) goes through :func:`get_executor`.  At most
+``tc_executor_workers`` of them run at once, the others wait in line, and
+a command still running after ``tc_command_timeout`` seconds is killed, so
+a tc call stuck on one interface holds up neither the RPC consumers nor
+the periodic tasks of the agent.  The commands run as green subprocesses,
+waiting for them never blocks the hub.
+"""
+
+import contextlib
+import time
+
+from eventlet import semaphore
+
+from traffic import exception
+from traffic import flags
+from traffic.openstack.common import cfg
+from traffic.openstack.common import log as logging
+from traffic import utils
+
+
+LOG = logging.getLogger(__name__)
+
+executor_opts = [
+    cfg.IntOpt('tc_executor_workers',
+               default=4,
+               help='Maximum number of tc commands the compute agent runs '
+                    'at once, the others wait for a free slot'),
+    cfg.IntOpt('tc_command_timeout',
+               default=60,
+               help='Seconds after which a tc command is killed, 0 to wait '
+                    'forever'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(executor_opts)
+
+_EXECUTOR = None
+
+
+def get_executor():
+    """Return the process wide executor sized by the tc_executor flags."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = CommandExecutor()
+    return _EXECUTOR
+
+
+class CommandExecutor(object):
+    """Bounded pool running commands with utils.execute."""
+
+    def __init__(self, workers=None, timeout=None, execute=None,
+                 execute_lines=None):
+        if workers is None:
+            workers = FLAGS.tc_executor_workers
+        if timeout is None:
+            timeout = FLAGS.tc_command_timeout
+        self.workers = max(workers, 1)
+        self.timeout = timeout or None
+        self._execute = execute or utils.execute
+        self._execute_lines = execute_lines or utils.execute_lines
+        self._slots = semaphore.Semaphore(self.workers)
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    @contextlib.contextmanager
+    def _slot(self, cmd):
+        queued = time.time()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.time()
+        self.wait_time += started - queued
+        self.running += 1
+        try:
+            yield
+        except exception.ProcessExecutionTimeout, e:
+            self.failed += 1
+            self.timed_out += 1
+            LOG.error(_('%(cmd)s killed after %(timeout)ss'),
+                      {'cmd': ' '.join(map(str, cmd)),
+                       'timeout': e.timeout})
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.run_time += time.time() - started
+            self._slots.release()
+
+    def execute(self, *cmd, **kwargs):
+        """utils.execute in a free slot, with the executor timeout."""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._slot(cmd):
+            return self._execute(*cmd, **kwargs)
+
+    def execute_lines(self, *cmd, **kwargs):
+        """utils.execute_lines holding a slot until the output is read."""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._slot(cmd):
+            for line in self._execute_lines(*cmd, **kwargs):
+                yield line
+
+    def stats(self):
+        """Return the queue depth and counters of the executor."""
+        return {'workers': self.workers,
+                'running': self.running,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+                'wait_time': round(self.wait_time, 3),
+                'run_time': round(self.run_time, 3)}
@@ -0,0 +1,241 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-memory index of the network interfaces of this host.
+
+The index is built once from /sys/class/net and then kept current from
+the RTM_NEWLINK/RTM_DELLINK events of the rtnetlink link group, so mac
+and name lookups never have to scrape ifconfig.
+
+Tap devices carry the mac of their guest nic with the first octet
+replaced (fa:16:3e:.. becomes fe:16:3e:..), so interfaces are indexed by
+the last five octets of their address.
+"""
+
+import os
+import struct
+
+from eventlet import greenthread
+
+from traffic.compute import netlink
+from traffic import exception
+from traffic.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+RTMGRP_LINK = 0x1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+
+_IFINFOMSG = struct.Struct('=BxHiII')
+
+_SYSFS_NET = '/sys/class/net'
+
+# seconds before the watcher subscribes again after a failure, doubled on
+# every failure in a row
+_WATCH_BACKOFF = 1
+_WATCH_BACKOFF_MAX = 60
+
+
+def mac_key(mac):
+    """Key of a mac address, ignoring the first octet."""
+    return mac.lower()[3:]
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+class InterfaceIndex(object):
+    """Map mac addresses and names to (ifname, ifindex) in O(1)."""
+
+    def __init__(self, sysfs=_SYSFS_NET):
+        self._sysfs = sysfs
+        self._by_mac = {}
+        self._by_name = {}
+        self._names = {}
+        self._watcher = None
+        # whether link events currently keep the index current
+        self._subscribed = False
+        self._loaded = False
+        self._listeners = []
+
+    def load(self, notify=False):
+        """(Re)build the index from sysfs.
+
+        With notify, the listeners are called for the interfaces that are
+        new or changed their mac since the index was last current.
+        """
+        known = dict(self._names)
+        self._by_mac.clear()
+        self._by_name.clear()
+        self._names.clear()
+        for name in os.listdir(self._sysfs):
+            try:
+                ifindex = int(_read(os.path.join(self._sysfs, name,
+                                                 'ifindex')))
+                mac = _read(os.path.join(self._sysfs, name, 'address'))
+            except (IOError, ValueError):
+                # the interface went away while we were reading it
+                continue
+            self._add(ifindex, name, mac)
+        self._loaded = True
+        if notify:
+            for ifindex, (name, mac) in self._names.items():
+                if known.get(ifindex, (None, None))[1] != mac:
+                    self._notify(name, ifindex, mac)
+
+    def _add(self, ifindex, name, mac):
+        self._remove(ifindex)
+        self._names[ifindex] = (name, mac)
+        self._by_name[name] = ifindex
+        if mac:
+            self._by_mac[mac_key(mac)] = (name, ifindex)
+
+    def _remove(self, ifindex):
+        name, mac = self._names.pop(ifindex, (None, None))
+        if name is None:
+            return
+        if self._by_name.get(name) == ifindex:
+            del self._by_name[name]
+        if mac and self._by_mac.get(mac_key(mac), (None, None))[1] == ifindex:
+            del self._by_mac[mac_key(mac)]
+
+    def _get(self, table, key):
+        if not self._loaded:
+            self.load()
+        elif key not in table and not self._subscribed:
+            # nothing keeps the index current, sysfs may know better
+            self.load(notify=True)
+        return table[key]
+
+    def lookup(self, mac):
+        """Return (ifname, ifindex) of the interface with this mac."""
+        try:
+            return self._get(self._by_mac, mac_key(mac))
+        except KeyError:
+            raise exception.NetInterfaceNotFound(interface=mac)
+
+    def ifindex(self, name):
+        """Return the ifindex of an interface name."""
+        try:
+            return self._get(self._by_name, name)
+        except KeyError:
+            raise exception.NetInterfaceNotFound(interface=name)
+
+    def add_listener(self, callback):
+        """Call callback(name, ifindex, mac) for every interface added.
+
+        Only interfaces showing up while the index follows link changes
+        are reported, from the watcher green thread, so callback must not
+        block.  An interface is reported again when its mac changes, as
+        libvirt only sets the mac of a tap once it is created.
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        """Follow link changes from a green thread."""
+        if self._watcher is not None:
+            return
+        sock = self._subscribe()
+        self._watcher = greenthread.spawn(self._watch, sock)
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.kill()
+            self._watcher = None
+            self._subscribed = False
+
+    def _subscribe(self, notify=False):
+        # subscribe before scanning so no change falls in between
+        sock = netlink.NetlinkSocket(groups=RTMGRP_LINK)
+        try:
+            self.load(notify)
+        except Exception:
+            sock.close()
+            raise
+        self._subscribed = True
+        return sock
+
+    def _watch(self, sock):
+        """Apply the link events, subscribing again whenever that fails.
+
+        Lookups missing the index rescan sysfs until the watcher is back,
+        and the rescan it starts with reports what changed meanwhile.
+        """
+        backoff = _WATCH_BACKOFF
+        while True:
+            try:
+                while True:
+                    for msg_type, _flags, _seq, payload in sock.recv():
+                        self.handle_message(msg_type, payload)
+                    backoff = _WATCH_BACKOFF
+            except Exception:
+                self._subscribed = False
+                LOG.exception(_('Interface watcher failed, subscribing '
+                                'again in %ss'), backoff)
+            finally:
+                sock.close()
+            sock = None
+            while sock is None:
+                greenthread.sleep(backoff)
+                backoff = min(backoff * 2, _WATCH_BACKOFF_MAX)
+                try:
+                    sock = self._subscribe(notify=True)
+                except Exception:
+                    LOG.exception(_('Failed to subscribe to link changes, '
+                                    'trying again in %ss'), backoff)
+
+    def handle_message(self, msg_type, payload):
+        """Apply one RTM_NEWLINK/RTM_DELLINK message to the index."""
+        if msg_type not in (RTM_NEWLINK, RTM_DELLINK):
+            return
+        _family, _type, ifindex, _flags, _change = \
+            _IFINFOMSG.unpack_from(payload)
+        if msg_type == RTM_DELLINK:
+            self._remove(ifindex)
+            return
+        attrs = netlink.parse_attrs(payload, _IFINFOMSG.size)
+        name = attrs.get(IFLA_IFNAME, '').rstrip('\0')
+        address = attrs.get(IFLA_ADDRESS, '')
+        mac = ':'.join('%02x' % ord(octet) for octet in address)
+        if name:
+            changed = self._names.get(ifindex, (None, None))[1] != mac
+            self._add(ifindex, name, mac)
+            if changed:
+                self._notify(name, ifindex, mac)
+
+    def _notify(self, name, ifindex, mac):
+        for callback in self._listeners:
+            try:
+                callback(name, ifindex, mac)
+            except Exception:
+                LOG.exception(_('Failed to handle the new interface %s'),
+                              name)
+
+
+_INDEX = None
+
+
+def get_index():
+    """Return the process wide interface index."""
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = InterfaceIndex()
+    return _INDEX
@@ -45,7 +45,13 @@ import traceback
 from eventlet import greenthread
 
 from traffic import compute
+from traffic.compute import classids
+from traffic.compute import executor
+from traffic.compute import interfaces
+from traffic.compute import reconciler
 from traffic.compute import rpcapi as compute_rpcapi
+from traffic.compute import stats
+from traffic.compute import tcbatch
 import traffic.context
 from traffic import exception
 from traffic import flags
@@ -61,6 +67,7 @@ from traffic.openstack.common.rpc import common as rpc_common
 from traffic.openstack.common.rpc import dispatcher as rpc_dispatcher
 from traffic.openstack.common import timeutils
 from traffic import tqdisc
+from traffic.tqdisc import parser
 from traffic import tfilter
 from traffic.scheduler import rpcapi as scheduler_rpcapi
 from traffic import utils
@@ -105,6 +112,21 @@ compute_opts = [
                default=60,
                help="Number of seconds between instance info_cache self "
                         "healing updates"),
+    cfg.IntOpt('traffic_reconcile_interval',
+               default=10,
+               help="Number of periodic scheduler ticks to wait between "
+                    "comparing the tc tree with the traffic tables and "
+                    "fixing the drift. Set to -1 to disable."),
+    cfg.BoolOpt('traffic_watch_links',
+                default=True,
+                help="Take over the traffic rule of an instance as soon as "
+                     "its tap shows up on this host after a live migration"),
+    cfg.IntOpt('traffic_takeover_wait',
+               default=900,
+               help="Number of seconds a new tap waits for its instance to "
+                    "be moved to this host before its traffic rule is taken "
+                    "over, the tap of a live migration shows up when it "
+                    "starts"),
     cfg.BoolOpt('instance_usage_audit',
                default=False,
                help="Generate periodic compute.instance.exists notifications"),
@@ -115,6 +137,9 @@ FLAGS.register_opts(compute_opts)
 
 LOG = logging.getLogger(__name__)
 
+# seconds between two checks of the host of a migrating instance
+TAKEOVER_POLL_INTERVAL = 2
+
 
 def publisher_id(host=None):
     return notifier.publisher_id("compute", host)
@@ -147,7 +172,7 @@ def reverts_task_state(function):
 class ComputeManager(manager.SchedulerDependentManager):
     """Manages the running instances from creation to destruction."""
 
-    RPC_API_VERSION = '2.2'
+    RPC_API_VERSION = '2.5'
 
     def __init__(self, compute_driver=None, *args, **kwargs):
         """Load configuration options and connect to the hypervisor."""
@@ -161,6 +186,29 @@ class ComputeManager(manager.SchedulerDependentManager):
         self._resource_tracker_dict = {}
         self.tqdisc_api = tqdisc.API()
         self.tfilter_api = tfilter.API()
+        self.tc_queue = tcbatch.TcBatchQueue()
+        # traffic operations on one instance run one at a time, in order
+        self.instance_locks = utils.KeyedLock()
+        self.reconciler = reconciler.Reconciler(self.tqdisc_api,
+                                                self.tfilter_api)
+        # drift fixed since startup, by kind
+        self.traffic_drift = dict((key, 0) for key in reconciler.DRIFT_KEYS)
+        self._reconcile_ticks_to_skip = 0
+        self.traffic_stats = stats.StatsCollector(FLAGS.interface)
+        self._stats_timer = None
+
+    def init_host(self):
+        """Initialization for a standalone compute service."""
+        if FLAGS.traffic_watch_links:
+            interfaces.get_index().add_listener(self._interface_added)
+        interfaces.get_index().start()
+        context = traffic.context.get_admin_context()
+        # seeding from the rules and the kernel frees minors a crash leaked
+        classids.get_pool().get_allocator(context, FLAGS.interface)
+        self._restore_traffic(context)
+        if FLAGS.traffic_stats_interval > 0:
+            self._stats_timer = utils.LoopingCall(self.traffic_stats.sample)
+            self._stats_timer.start(FLAGS.traffic_stats_interval)
 
     def get_console_topic(self, context):
         """Retrieves the console host for a project on this host.
@@ -277,13 +325,328 @@ class ComputeManager(manager.SchedulerDependentManager):
 
 
 
+    def _apply_tc_batch(self, batch):
+        """Apply a batch with the other pending operations of this host.
+
+        Returns the failed results, which are tagged with the tqdisc or
+        tfilter row they belong to.
+        """
+        results = self.tc_queue.submit(batch)
+        return tcbatch.log_failures(results)
+
+    def _drop_refused_rules(self, context, rules, failed):
+        """Undo the new rules whose class tc refused to add.
+
+        Their rows are deleted, their minors go back to the pool and their
+        filters are removed, so that a create tc rejects leaves nothing
+        behind for the reconciler to retry forever.
+        """
+        refused = set()
+        failed_filters = set()
+        for result in failed:
+            if not result.tag or result.command.action != 'add':
+                continue
+            kind, instance_id = result.tag
+            if kind == 'tqdisc' and result.command.obj == 'class':
+                refused.add(instance_id)
+            elif kind == 'tfilter':
+                failed_filters.add(instance_id)
+        if not refused:
+            return
+
+        pool = classids.get_pool()
+        batch = tcbatch.TcBatch()
+        for rule in rules:
+            instance_id = rule['instanceid']
+            if instance_id not in refused:
+                continue
+            self.db.traffic_rule_delete_by_instance(context, instance_id)
+            if instance_id not in failed_filters:
+                self.tfilter_api.delete(
+                    context, instance_id, batch=batch,
+                    rule={'handle': rule.get('handle')})
+            pool.free(context, FLAGS.interface, rule['classid'])
+            LOG.warn(_('Dropped the traffic rule of instance %s, tc refused '
+                       'its class'), instance_id)
+        self._apply_tc_batch(batch)
+
     def create_traffic(self, context, ip, instance_id, band, host, mac, prio):
-        classid = self.tqdisc_api.create(context, instance_id, band, host, ip, mac, prio)
-        self.tfilter_api.create(context, ip, classid, instance_id, host)
+        with self.instance_locks.lock(instance_id):
+            batch = tcbatch.TcBatch()
+            rule = {}
+            try:
+                classid = self.tqdisc_api.create(context, instance_id, band,
+                                                 host, ip, mac, prio,
+                                                 batch=batch, rule=rule)
+                self.tfilter_api.create(context, ip, classid, instance_id,
+                                        host, batch=batch, rule=rule)
+                self.db.traffic_rule_create(context, rule)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    # nothing of the batch reached the kernel yet
+                    classids.get_pool().free(context, FLAGS.interface,
+                                             rule.get('classid'))
+            failed = self._apply_tc_batch(batch)
+            self._drop_refused_rules(context, [rule], failed)
+
+    def create_traffic_bulk(self, context, traffics):
+        """Create the classes and filters of many instances in one batch.
+
+        traffics is a list of dicts with instance_id, ip, mac, band and
+        prio keys, all of instances of this host.
+        """
+        instance_ids = [traffic['instance_id'] for traffic in traffics]
+        pool = classids.get_pool()
+        with self.instance_locks.lock(*instance_ids):
+            batch = tcbatch.TcBatch()
+            rules = []
+            for traffic in traffics:
+                rule = {}
+                # the commands of an instance only join the batch once
+                # both its class and filter are queued
+                queued = tcbatch.TcBatch()
+                try:
+                    classid = self.tqdisc_api.create(
+                        context, traffic['instance_id'], traffic['band'],
+                        self.host, traffic['ip'], traffic['mac'],
+                        traffic['prio'], batch=queued, rule=rule)
+                    self.tfilter_api.create(context, traffic['ip'],
+                                            classid,
+                                            traffic['instance_id'],
+                                            self.host, batch=queued,
+                                            rule=rule)
+                except Exception:
+                    LOG.exception(_('Failed to create the traffic of '
+                                    'instance %s'), traffic['instance_id'])
+                    pool.free(context, FLAGS.interface,
+                              rule.get('classid'))
+                else:
+                    batch.extend(queued)
+                    rules.append(rule)
+            try:
+                self.db.traffic_rule_create_many(context, rules)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    for rule in rules:
+                        pool.free(context, FLAGS.interface,
+                                  rule['classid'])
+            failed = self._apply_tc_batch(batch)
+            self._drop_refused_rules(context, rules, failed)
+
+    def update_traffic(self, context, instance_id, band, prio=None):
+        with self.instance_locks.lock(instance_id):
+            batch = tcbatch.TcBatch()
+            self.tqdisc_api.update(context, instance_id, band, prio,
+                                   batch=batch)
+            self._apply_tc_batch(batch)
 
     def delete_traffic(self, context, instance_id):
-        self.tfilter_api.delete(context, instance_id)
-        self.tqdisc_api.delete(context, instance_id)
+        with self.instance_locks.lock(instance_id):
+            rule = self.db.traffic_rule_get_by_instance(context, instance_id)
+            if rule is None:
+                raise exception.NoTqdisc(tqdisc=instance_id)
+            self.db.traffic_rule_delete_by_instance(context, instance_id)
+            batch = tcbatch.TcBatch()
+            self.tfilter_api.delete(context, instance_id, batch=batch,
+                                    rule=rule)
+            self.tqdisc_api.delete(context, instance_id, batch=batch,
+                                   rule=rule)
+            self._apply_tc_batch(batch)
+
+    def _interface_added(self, name, ifindex, mac):
+        if mac and mac != '00:00:00:00:00:00':
+            greenthread.spawn_n(self._apply_traffic_of_interface, name,
+                                ifindex, mac)
+
+    def _moved_here(self, context, instance_id, name, ifindex):
+        """Wait until the instance of a new tap is moved to this host.
+
+        The tap of a live migration shows up when it starts while the
+        instance only moves once it completes.  Returns False when the tap
+        goes away first, as on a rollback, or after traffic_takeover_wait.
+        """
+        deadline = time.time() + FLAGS.traffic_takeover_wait
+        while True:
+            row = self.db.get_host_by_instance(context, instance_id)
+            if row is not None and row[0] == self.host:
+                return True
+            try:
+                if interfaces.get_index().ifindex(name) != ifindex:
+                    return False
+            except exception.NetInterfaceNotFound:
+                return False
+            if time.time() >= deadline:
+                return False
+            greenthread.sleep(TAKEOVER_POLL_INTERVAL)
+
+    def _undo_takeover(self, context, instance_id, moved, failed=None):
+        """Remove what a failed takeover added and free its minor.
+
+        failed are the failed results of the takeover batch, None when
+        nothing is known of what went in.
+        """
+        refused = set((result.tag[0], result.command.obj)
+                      for result in failed or ()
+                      if result.tag and result.command.action == 'add')
+        batch = tcbatch.TcBatch()
+        if moved.get('handle') is not None and \
+                ('tfilter', 'filter') not in refused:
+            self.tfilter_api.delete(context, instance_id, batch=batch,
+                                    rule={'handle': moved['handle']})
+        if ('tqdisc', 'class') in refused:
+            classids.get_pool().free(context, FLAGS.interface,
+                                     moved['classid'])
+        else:
+            self.tqdisc_api.delete(context, instance_id, batch=batch,
+                                   rule={'classid': moved['classid']})
+        self._apply_tc_batch(batch)
+
+    def _apply_traffic_of_interface(self, name, ifindex, mac):
+        """Apply the rule of the instance a new tap belongs to.
+
+        The classes and filters of this host are on its uplink, they do not
+        depend on the tap and are left alone.  A rule of another host means
+        the instance is being live migrated here: once the instance is
+        moved, its class and filter are added on this host and, when tc
+        took both, the rule moved over; the reconciler of the former host
+        then removes them there.  Otherwise the rule stays where it is.
+        """
+        context = traffic.context.get_admin_context()
+        try:
+            rule = self.db.traffic_rule_get_by_mac(context, mac)
+            if rule is None or rule['host'] == self.host:
+                return
+            instance_id = rule['instanceid']
+            if not self._moved_here(context, instance_id, name, ifindex):
+                LOG.info(_('Left the traffic of instance %(instance)s on '
+                           '%(host)s, it was not moved to this host'),
+                         {'instance': instance_id, 'host': rule['host']})
+                return
+            with self.instance_locks.lock(instance_id):
+                # a delete or another move may have run in the meantime
+                rule = self.db.traffic_rule_get_by_instance(context,
+                                                            instance_id)
+                if rule is None or rule['host'] == self.host:
+                    return
+                start = time.time()
+                batch = tcbatch.TcBatch()
+                moved = {}
+                try:
+                    classid = self.tqdisc_api.create(
+                        context, instance_id, parser.parse_band(rule['band']),
+                        self.host, rule['ip'], mac, rule['prio'],
+                        batch=batch, rule=moved)
+                    if rule['handle'] is not None:
+                        self.tfilter_api.create(context, rule['ip'], classid,
+                                                instance_id, self.host,
+                                                batch=batch, rule=moved)
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        # nothing of the batch reached the kernel yet
+                        classids.get_pool().free(context, FLAGS.interface,
+                                                 moved.get('classid'))
+                try:
+                    failed = self._apply_tc_batch(batch)
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        self._undo_takeover(context, instance_id, moved)
+                tags = (('tqdisc', instance_id), ('tfilter', instance_id))
+                failed = [result for result in failed
+                          if result.tag in tags or result.tag is None]
+                if failed:
+                    self._undo_takeover(context, instance_id, moved, failed)
+                    LOG.warn(_('Left the traffic of instance %(instance)s '
+                               'on %(host)s, tc refused it on %(name)s'),
+                             {'instance': instance_id, 'host': rule['host'],
+                              'name': name})
+                    return
+                self.db.traffic_rule_move(context, rule['id'], self.host,
+                                          classid, moved.get('handle'))
+            LOG.info(_('Took over the traffic of instance %(instance)s from '
+                       '%(host)s on %(name)s in %(duration).3fs'),
+                     {'instance': instance_id, 'host': rule['host'],
+                      'name': name, 'duration': time.time() - start})
+        except Exception:
+            LOG.exception(_('Failed to apply the traffic of interface %s'),
+                          name)
+
+    def get_traffic_stats(self, context, instance_id, window=None):
+        """Return the bandwidth statistics of the class of an instance."""
+        classid = self.db.get_classid_by_instance(context, instance_id,
+                                                  use_slave=True)
+        if not classid or not classid[0]:
+            raise exception.NoTqdisc(tqdisc=instance_id)
+        summary = self.traffic_stats.summary(classid[0], window)
+        if summary is None:
+            raise exception.NoTqdisc(tqdisc=classid[0])
+        summary['instance_id'] = instance_id
+        return summary
+
+    def _sync_traffic(self, context, interface):
+        """Apply the operations the tc tree of interface is missing.
+
+        Returns the drift found and the failed tc results.
+        """
+        batch, drift, moved = self.reconciler.reconcile(context, self.host,
+                                                        interface)
+        failed = self._apply_tc_batch(batch)
+        for rule_id, handle in moved.iteritems():
+            self.db.traffic_rule_update_handle(context, rule_id, handle)
+        return drift, failed
+
+    def _restore_traffic(self, context):
+        """Rebuild the tc tree of this host from the db after a restart.
+
+        Whatever is still in the kernel is kept, only the missing root,
+        classes and filters are added, all in a single batch.
+        """
+        start = time.time()
+        interface = FLAGS.interface
+        try:
+            drift, failed = self._sync_traffic(context, interface)
+        except Exception:
+            LOG.exception(_('Failed to restore the tc tree of %s'), interface)
+            return
+        LOG.info(_('Restored %(classes)d classes and %(filters)d filters on '
+                   '%(interface)s in %(duration).3fs, %(failed)d failed'),
+                 {'classes': drift['classes_missing'],
+                  'filters': drift['filters_missing'],
+                  'interface': interface,
+                  'duration': time.time() - start,
+                  'failed': len(failed)})
+
+    @manager.periodic_task
+    def _reconcile_traffic(self, context):
+        """Bring the tc tree of this host back in line with the db."""
+        # the interval is read on every tick, not once at import
+        if FLAGS.traffic_reconcile_interval < 0:
+            return
+        if self._reconcile_ticks_to_skip > 0:
+            self._reconcile_ticks_to_skip -= 1
+            return
+        self._reconcile_ticks_to_skip = FLAGS.traffic_reconcile_interval
+
+        start = time.time()
+        interface = FLAGS.interface
+        drift, failed = self._sync_traffic(context, interface)
+
+        for key, count in drift.iteritems():
+            self.traffic_drift[key] += count
+        payload = dict(drift)
+        payload.update(host=self.host, interface=interface,
+                       failed=len(failed),
+                       duration=round(time.time() - start, 3),
+                       executor=executor.get_executor().stats())
+        if sum(drift.values()):
+            LOG.warn(_('Fixed tc drift on %(interface)s: %(payload)s'),
+                     locals())
+        else:
+            LOG.debug(_('No tc drift on %(interface)s, checked in '
+                        '%(duration)ss'), payload)
+        notifier.notify(context, publisher_id(self.host),
+                        'traffic.reconcile',
+                        notifier.WARN if failed else notifier.INFO,
+                        payload)
 
     def _deallocate_network(self, context, instance):
         LOG.debug(_('Deallocating network for instance'), instance=instance)
@@ -0,0 +1,447 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Pure python rtnetlink support.
+
+:class:`NetlinkSocket` is a minimal NETLINK_ROUTE socket and
+:class:`NetlinkTcDriver` a tc driver (see :mod:`traffic.compute.tcbatch`)
+that programs htb qdiscs/classes and u32 filters with RTM_NEWQDISC,
+RTM_NEWTCLASS and RTM_NEWTFILTER messages over one long-lived socket
+instead of spawning tc.  Every request asks for an ACK so that the kernel
+errors are reported per command.
+"""
+
+import os
+import re
+import socket
+import struct
+
+from traffic.compute import tcbatch
+from traffic import exception
+from traffic.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWQDISC = 36
+RTM_DELQDISC = 37
+RTM_NEWTCLASS = 40
+RTM_DELTCLASS = 41
+RTM_NEWTFILTER = 44
+RTM_DELTFILTER = 45
+
+TC_H_ROOT = 0xFFFFFFFF
+TC_H_INGRESS = 0xFFFFFFF1
+
+TCA_KIND = 1
+TCA_OPTIONS = 2
+
+TCA_HTB_PARMS = 1
+TCA_HTB_INIT = 2
+TCA_HTB_CTAB = 3
+TCA_HTB_RTAB = 4
+
+TCA_U32_CLASSID = 1
+TCA_U32_HASH = 2
+TCA_U32_LINK = 3
+TCA_U32_DIVISOR = 4
+TCA_U32_SEL = 5
+TCA_U32_POLICE = 6
+
+TCA_POLICE_TBF = 1
+TCA_POLICE_RATE = 2
+
+TC_U32_TERMINAL = 1
+TC_POLICE_SHOT = 2
+TC_LINKLAYER_ETHERNET = 1
+
+ETH_P_IP = 0x0800
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_NLATTR = struct.Struct('=HH')
+_TCMSG = struct.Struct('=BxxxiIII')
+_RATESPEC = struct.Struct('=BBHhHI')
+_TC_HTB_GLOB = struct.Struct('=IIIII')
+_U32_SEL = struct.Struct('=BBBxHHhh')
+_U32_KEY = struct.Struct('=ii')
+
+_MATCH_OFFSETS = {'src': 12, 'dst': 16}
+
+_RATE_UNITS = {'': 1, 'bit': 1, 'kbit': 1000, 'mbit': 1000 ** 2,
+               'gbit': 1000 ** 3, 'bps': 8, 'kbps': 8000,
+               'mbps': 8 * 1000 ** 2, 'gbps': 8 * 1000 ** 3}
+_SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2,
+               'mb': 1024 ** 2, 'kbit': 128, 'mbit': 128 * 1024}
+_UNIT_RE = re.compile(r'^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$')
+
+# default mtu used by tc for rate tables and htb buffers
+_RTAB_MTU = 2047
+_HTB_MTU = 1600
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def attr(attr_type, data):
+    """Pack one netlink attribute (struct nlattr plus padded payload)."""
+    length = _NLATTR.size + len(data)
+    return (_NLATTR.pack(length, attr_type) + data +
+            '\0' * (align(length) - length))
+
+
+def nested(attr_type, *attrs):
+    return attr(attr_type, ''.join(attrs))
+
+
+def parse_attrs(data, offset=0):
+    """Return a dict of attribute type to raw payload."""
+    attrs = {}
+    end = len(data)
+    while offset + _NLATTR.size <= end:
+        length, attr_type = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        attrs[attr_type & 0x7fff] = data[offset + _NLATTR.size:
+                                         offset + length]
+        offset += align(length)
+    return attrs
+
+
+def parse_messages(data):
+    """Yield (type, flags, seq, payload) for every message in a buffer."""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, _pid = _NLMSGHDR.unpack_from(data,
+                                                                   offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield (msg_type, flags, seq,
+               data[offset + _NLMSGHDR.size:offset + length])
+        offset += align(length)
+
+
+class NetlinkSocket(object):
+    """A NETLINK_ROUTE socket, optionally subscribed to multicast groups."""
+
+    def __init__(self, groups=0, rcvbuf=1024 * 1024):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((0, groups))
+        self._seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    def send(self, msg_type, flags, payload):
+        """Send one request and return its sequence number."""
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        header = _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type,
+                                flags | NLM_F_REQUEST, self._seq, 0)
+        self.sock.sendall(header + payload)
+        return self._seq
+
+    def recv(self, bufsize=65536):
+        return list(parse_messages(self.sock.recv(bufsize)))
+
+
+def _errno(payload):
+    return struct.unpack_from('=i', payload)[0]
+
+
+def parse_handle(handle, default_major=0):
+    """Convert a tc handle ('10:', '10:1', ':1', 'root') to an integer."""
+    if handle in (None, '', 'none'):
+        return 0
+    if handle == 'root':
+        return TC_H_ROOT
+    if handle == 'ingress':
+        return TC_H_INGRESS
+    major, _sep, minor = str(handle).partition(':')
+    major = int(major, 16) if major else default_major
+    minor = int(minor, 16) if minor else 0
+    return ((major & 0xFFFF) << 16) | (minor & 0xFFFF)
+
+
+def parse_u32_handle(handle):
+    """Convert a u32 handle ('800:', '800::801', '1:2:3') to an integer."""
+    if not handle:
+        return 0
+    parts = (str(handle).split(':') + ['', ''])[:3]
+    htid, bucket, node = [int(part, 16) if part else 0 for part in parts]
+    return (htid << 20) | (bucket << 12) | node
+
+
+def _parse_units(value, units, what):
+    match = _UNIT_RE.match(str(value))
+    if not match or match.group(2).lower() not in units:
+        raise exception.TrafficException(_('Invalid %(what)s %(value)s')
+                                         % locals())
+    return float(match.group(1)) * units[match.group(2).lower()]
+
+
+def parse_rate(rate):
+    """Convert a tc rate ('10Mbit', '1gbit', '100kbps') to bytes/s."""
+    return int(_parse_units(rate, _RATE_UNITS, 'rate') / 8)
+
+
+def parse_size(size):
+    """Convert a tc size ('10k', '1500b', '1mb') to bytes."""
+    return int(_parse_units(size, _SIZE_UNITS, 'size'))
+
+
+class _PschedClock(object):
+    """Kernel packet scheduler clock, as read by tc from /proc/net/psched."""
+
+    def __init__(self, path='/proc/net/psched'):
+        self.tick_in_usec = 1.0
+        self.hz = 100
+        try:
+            with open(path) as psched:
+                t2us, us2t, clock_res, hz = [int(field, 16) for field in
+                                             psched.read().split()[:4]]
+        except (IOError, ValueError):
+            LOG.warn(_('Could not read %s, assuming a 1us tick'), path)
+            return
+        if clock_res == 1000000000:
+            t2us = us2t
+        self.tick_in_usec = float(t2us) / us2t * (clock_res / 1000000.0)
+        if clock_res == 1000000:
+            self.hz = hz
+
+    def xmittime(self, rate, size):
+        """Ticks needed to send size bytes at rate bytes/s."""
+        return int(1000000.0 * size / rate * self.tick_in_usec)
+
+
+_CLOCK = None
+
+
+def _clock():
+    global _CLOCK
+    if _CLOCK is None:
+        _CLOCK = _PschedClock()
+    return _CLOCK
+
+
+def _rate_table(rate):
+    """Return (tc_ratespec, rtab) for a rate in bytes/s, like tc does."""
+    cell_log = 0
+    while (_RTAB_MTU >> cell_log) > 255:
+        cell_log += 1
+    clock = _clock()
+    rtab = struct.pack('=256I', *[clock.xmittime(rate, (i + 1) << cell_log)
+                                  for i in xrange(256)])
+    spec = _RATESPEC.pack(cell_log, TC_LINKLAYER_ETHERNET, 0, -1, 0,
+                          min(rate, 0xFFFFFFFF))
+    return spec, rtab
+
+
+class NetlinkTcDriver(tcbatch.TcDriver):
+    """tc driver sending rtnetlink requests over one long-lived socket.
+
+    Requests are pipelined; at most ``window`` of them wait for their ACK
+    at any time so that the socket receive buffer can not overflow.
+    """
+
+    window = 256
+
+    def __init__(self, index=None):
+        self._sock = None
+        self._index = index
+
+    def _socket(self):
+        if self._sock is None:
+            self._sock = NetlinkSocket()
+        return self._sock
+
+    def _ifindex(self, dev):
+        if self._index is None:
+            # NOTE: imported here as the interface index is built on top
+            #       of this module
+            from traffic.compute import interfaces
+            self._index = interfaces.get_index()
+        return self._index.ifindex(dev)
+
+    def apply(self, commands):
+        errors = {}
+        inflight = {}
+        try:
+            sock = self._socket()
+            for index, command in enumerate(commands):
+                try:
+                    msg_type, flags, payload = self._message(command)
+                except exception.TrafficException as e:
+                    errors[index] = unicode(e)
+                    continue
+                inflight[sock.send(msg_type, flags | NLM_F_ACK,
+                                   payload)] = index
+                while len(inflight) >= self.window:
+                    self._read_acks(sock, inflight, errors)
+            while inflight:
+                self._read_acks(sock, inflight, errors)
+        except socket.error as e:
+            # the socket state is unknown now, start over with a new one
+            LOG.error(_('rtnetlink socket failed: %s'), e)
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+            for index in inflight.itervalues():
+                errors[index] = unicode(e)
+        return [tcbatch.TcResult(command, errors.get(index))
+                for index, command in enumerate(commands)]
+
+    def _read_acks(self, sock, inflight, errors):
+        for msg_type, _flags, seq, payload in sock.recv():
+            if msg_type != NLMSG_ERROR or seq not in inflight:
+                continue
+            index = inflight.pop(seq)
+            error = _errno(payload)
+            if error:
+                errors[index] = os.strerror(-error)
+
+    def _message(self, command):
+        build = getattr(self, '_%s_message' % command.obj)
+        return build(command, self._ifindex(command.dev))
+
+    def _flags(self, action):
+        return {'add': NLM_F_CREATE | NLM_F_EXCL,
+                'replace': NLM_F_CREATE | NLM_F_REPLACE,
+                'change': 0,
+                'del': 0}[action]
+
+    def _qdisc_message(self, command, ifindex):
+        opts = command.opts
+        parent = parse_handle(opts.get('parent', 'root'))
+        if command.action == 'del':
+            return RTM_DELQDISC, 0, _TCMSG.pack(0, ifindex, 0, parent, 0)
+
+        if parent == TC_H_INGRESS:
+            payload = (_TCMSG.pack(0, ifindex, 0xFFFF0000, parent, 0) +
+                       attr(TCA_KIND, 'ingress\0'))
+        else:
+            kind = opts.get('kind', 'htb')
+            payload = (_TCMSG.pack(0, ifindex, parse_handle(opts['handle']),
+                                   parent, 0) +
+                       attr(TCA_KIND, kind + '\0'))
+            if kind == 'htb':
+                defcls = int(str(opts.get('default') or 0), 16)
+                glob = _TC_HTB_GLOB.pack(3, 10, defcls, 0, 0)
+                payload += nested(TCA_OPTIONS, attr(TCA_HTB_INIT, glob))
+        return RTM_NEWQDISC, self._flags(command.action), payload
+
+    def _class_message(self, command, ifindex):
+        opts = command.opts
+        classid = parse_handle(opts['classid'])
+        parent = parse_handle(opts.get('parent'))
+        if command.action == 'del':
+            return (RTM_DELTCLASS, 0,
+                    _TCMSG.pack(0, ifindex, classid, parent, 0))
+
+        rate = parse_rate(opts['rate'])
+        ceil = parse_rate(opts.get('ceil') or opts['rate'])
+        clock = _clock()
+        rate_spec, rtab = _rate_table(rate)
+        ceil_spec, ctab = _rate_table(ceil)
+        buffer = clock.xmittime(rate, rate / clock.hz + _HTB_MTU)
+        cbuffer = clock.xmittime(ceil, ceil / clock.hz + _HTB_MTU)
+        parms = (rate_spec + ceil_spec +
+                 struct.pack('=IIIII', buffer, cbuffer, 0, 0,
+                             int(opts.get('prio') or 0)))
+        payload = (_TCMSG.pack(0, ifindex, classid, parent, 0) +
+                   attr(TCA_KIND, 'htb\0') +
+                   nested(TCA_OPTIONS,
+                          attr(TCA_HTB_PARMS, parms),
+                          attr(TCA_HTB_RTAB, rtab),
+                          attr(TCA_HTB_CTAB, ctab)))
+        return RTM_NEWTCLASS, self._flags(command.action), payload
+
+    def _filter_message(self, command, ifindex):
+        opts = command.opts
+        parent = parse_handle(opts['parent'])
+        info = (int(opts['prio']) << 16) | socket.htons(ETH_P_IP)
+        handle = parse_u32_handle(opts.get('handle'))
+        if command.action == 'del':
+            return (RTM_DELTFILTER, 0,
+                    _TCMSG.pack(0, ifindex, handle, parent, info) +
+                    attr(TCA_KIND, 'u32\0'))
+
+        if opts.get('divisor'):
+            payload = (_TCMSG.pack(0, ifindex, handle, parent, info) +
+                       attr(TCA_KIND, 'u32\0') +
+                       nested(TCA_OPTIONS,
+                              attr(TCA_U32_DIVISOR,
+                                   struct.pack('=I', int(opts['divisor'])))))
+            return RTM_NEWTFILTER, self._flags(command.action), payload
+
+        options = []
+        if opts.get('ht'):
+            options.append(attr(TCA_U32_HASH,
+                                struct.pack('=I',
+                                            parse_u32_handle(opts['ht']))))
+        if opts.get('link'):
+            options.append(attr(TCA_U32_LINK,
+                                struct.pack('=I',
+                                            parse_u32_handle(opts['link']))))
+        if opts.get('flowid'):
+            options.append(attr(TCA_U32_CLASSID,
+                                struct.pack('=I',
+                                            parse_handle(opts['flowid']))))
+        options.append(attr(TCA_U32_SEL, self._u32_selector(opts)))
+        if opts.get('police'):
+            options.append(self._police(*opts['police']))
+        payload = (_TCMSG.pack(0, ifindex, handle, parent, info) +
+                   attr(TCA_KIND, 'u32\0') +
+                   nested(TCA_OPTIONS, *options))
+        return RTM_NEWTFILTER, self._flags(command.action), payload
+
+    def _u32_selector(self, opts):
+        keys = []
+        for field, value in opts.get('match', ()):
+            address, _sep, prefix = value.partition('/')
+            prefix = int(prefix or 32)
+            if not prefix:
+                # a /0 match is every packet, no key needed
+                continue
+            mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+            value = struct.unpack('!I', socket.inet_aton(address))[0]
+            keys.append(struct.pack('!II', mask, value & mask) +
+                        _U32_KEY.pack(_MATCH_OFFSETS[field], 0))
+        flags = TC_U32_TERMINAL if opts.get('flowid') else 0
+        hmask, hoff = opts.get('hashkey') or (0, 0)
+        return (_U32_SEL.pack(flags, 0, len(keys), 0, 0, 0, hoff) +
+                struct.pack('!I', hmask) + ''.join(keys))
+
+    def _police(self, rate, burst):
+        rate = parse_rate(rate)
+        spec, rtab = _rate_table(rate)
+        tbf = (struct.pack('=IiIII', 0, TC_POLICE_SHOT, 0,
+                           _clock().xmittime(rate, parse_size(burst)), 0) +
+               spec + '\0' * _RATESPEC.size + struct.pack('=iiI', 0, 0, 0))
+        return nested(TCA_U32_POLICE,
+                      attr(TCA_POLICE_TBF, tbf),
+                      attr(TCA_POLICE_RATE, rtab))
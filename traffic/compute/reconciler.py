@@ -0,0 +1,169 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Reconciliation of the kernel tc tree with the traffic rules.
+
+The live htb classes and u32 filters of an interface are dumped once and
+diffed against the rows of this host; only the operations needed to bring
+the kernel back in line are queued.
+"""
+
+from traffic.compute import classids
+from traffic.compute import netlink
+from traffic.compute import tcbatch
+from traffic import flags
+from traffic.openstack.common import log as logging
+from traffic.tfilter import api as tfilter
+from traffic.tqdisc import parser
+
+
+LOG = logging.getLogger(__name__)
+
+FLAGS = flags.FLAGS
+
+PARENT_CLASS = '10:1'
+
+DRIFT_KEYS = ('classes_missing', 'classes_changed', 'classes_extra',
+              'hashtables_missing', 'links_missing', 'links_changed',
+              'filters_missing', 'filters_changed', 'filters_extra')
+
+
+class Reconciler(object):
+    """Diff the tc tree of an interface against the database."""
+
+    def __init__(self, tqdisc_api, tfilter_api):
+        self.tqdisc_api = tqdisc_api
+        self.tfilter_api = tfilter_api
+
+    def reconcile(self, context, host, interface):
+        """Queue the operations that fix the drift of interface.
+
+        Returns (batch, drift, moved), drift counting the differences by
+        kind and moved mapping rule ids to the handle their filter is
+        re-added at.
+        """
+        db = self.tqdisc_api.db
+        pool = classids.get_pool()
+        live_classes = dict((record.handle, record) for record in
+                            parser.show_classes(interface, stats=False))
+        with self.tfilter_api.lock(interface):
+            records = list(parser.show_filters(interface))
+            self.tfilter_api.load_tables(interface, records)
+        offset = tfilter.MATCH_OFFSETS[FLAGS.tc_filter_match]
+        live_filters = dict((record.handle, (record.prio, record.flowid,
+                                             record.address(offset)))
+                            for record in records if record.flowid)
+
+        want_classes = {}
+        want_filters = {}
+        for row in db.traffic_rule_get_all_by_host(context, host):
+            if row['classid']:
+                want_classes[row['classid']] = row
+            if row['handle'] is not None:
+                handle = netlink.parse_u32_handle(
+                    tfilter.u32_handle(row['handle']))
+                want_filters[handle] = row
+
+        drift = dict((key, 0) for key in DRIFT_KEYS)
+        tc = tcbatch.TcBatch()
+        stale_filters = tcbatch.TcBatch()
+        stale_classes = tcbatch.TcBatch()
+
+        if PARENT_CLASS not in live_classes:
+            self.tqdisc_api.add_root(interface, tc)
+
+        for classid, row in want_classes.iteritems():
+            tag = ('tqdisc', row['instanceid'])
+            live = live_classes.get(classid)
+            if live is None:
+                drift['classes_missing'] += 1
+                tc.add_class(interface, PARENT_CLASS, classid, row['band'],
+                             prio=row['prio'], tag=tag)
+            elif live.parent != PARENT_CLASS or \
+                    live.rate != parser.parse_rate(row['band']) or \
+                    (row['prio'] is not None and live.prio != row['prio']):
+                drift['classes_changed'] += 1
+                tc.change_class(interface, PARENT_CLASS, classid,
+                                row['band'], prio=row['prio'], tag=tag)
+        for classid, live in live_classes.iteritems():
+            if live.parent != PARENT_CLASS or classid in want_classes:
+                continue
+            _major, minor = classids.parse_classid(classid)
+            if minor > classids.RESERVED_MINORS:
+                drift['classes_extra'] += 1
+                stale_classes.del_class(interface, classid)
+                # the class of a rule deleted or moved to another host
+                pool.free(context, interface, classid)
+
+        # the subnet tables the filters of the rules go in, before them
+        prio = tfilter.FILTER_PRIO
+        live_tables = set()
+        live_links = {}
+        for record in records:
+            if record.prio != prio:
+                continue
+            if record.divisor:
+                live_tables.add(record.handle >> 20)
+            elif record.link and record.handle >> 20 == tfilter.ROOT_HTID:
+                live_links[record.link >> 20] = record
+        subnets = self.tfilter_api.subnet_tables(interface, prio)
+        for subnet in set(row['ip'].rpartition('.')[0]
+                          for row in want_filters.itervalues()):
+            htid = subnets.get(subnet)
+            if htid is None:
+                # queue_filter adds the table with the first filter
+                continue
+            if htid not in live_tables:
+                drift['hashtables_missing'] += 1
+                self.tfilter_api.queue_hashtable(interface, prio, htid, tc)
+            link = live_links.get(htid)
+            if link is not None and tfilter.link_subnet(link) == subnet:
+                continue
+            if link is None:
+                drift['links_missing'] += 1
+            else:
+                drift['links_changed'] += 1
+                stale_filters.del_filter(interface, '10:', prio,
+                                         parser.format_u32_handle(
+                                             link.handle))
+            self.tfilter_api.queue_link(interface, prio, subnet, htid, tc)
+
+        moved = {}
+        for handle, row in want_filters.iteritems():
+            live = live_filters.get(handle)
+            if live == (tfilter.FILTER_PRIO, row['classid'], row['ip']):
+                continue
+            if live is None:
+                drift['filters_missing'] += 1
+            else:
+                drift['filters_changed'] += 1
+                stale_filters.del_filter(
+                    interface, '10:', live[0],
+                    tfilter.u32_handle(row['handle']))
+            new_handle = self.tfilter_api.queue_filter(
+                interface, row['ip'], row['classid'], tfilter.FILTER_PRIO, tc,
+                tag=('tfilter', row['instanceid']))
+            if new_handle != row['handle']:
+                moved[row['id']] = new_handle
+        for handle, (prio, _flowid, _ip) in live_filters.iteritems():
+            if handle not in want_filters:
+                drift['filters_extra'] += 1
+                stale_filters.del_filter(interface, '10:', prio,
+                                         tfilter.u32_handle(handle))
+
+        # filters go first so that no class is deleted while a filter still
+        # points at it, and both before anything is (re)added
+        stale_filters.extend(stale_classes)
+        stale_filters.extend(tc)
+        return stale_filters, drift, moved
@@ -131,6 +131,9 @@ class ComputeAPI(traffic.openstack.common.rpc.proxy.RpcProxy):
         2.1 - Adds orig_sys_metadata to rebuild_instance()
         2.2 - Adds slave_info parameter to add_aggregate_host() and
               remove_aggregate_host()
+        2.3 - Adds get_traffic_stats()
+        2.4 - Adds create_traffic_bulk()
+        2.5 - Adds update_traffic()
     '''
 
     #
@@ -466,10 +469,28 @@ class ComputeAPI(traffic.openstack.common.rpc.proxy.RpcProxy):
                   topic=_compute_topic(self.topic, ctxt, host, None))
     
     
+    def update_traffic(self, ctxt, instance_id, band, prio, host):
+        self.cast(ctxt, self.make_msg('update_traffic',
+                instance_id=instance_id, band=band, prio=prio),
+                topic=_compute_topic(self.topic, ctxt, host, None),
+                version='2.5')
+
     def delete_traffic(self, ctxt, instance_id, host, mac):
         self.cast(ctxt, self.make_msg('delete_traffic', instance_id=instance_id),
                   topic=_compute_topic(self.topic, ctxt, host, None))
 
+    def get_traffic_stats(self, ctxt, instance_id, window, host):
+        return self.call(ctxt, self.make_msg('get_traffic_stats',
+                instance_id=instance_id, window=window),
+                topic=_compute_topic(self.topic, ctxt, host, None),
+                version='2.3')
+
+    def create_traffic_bulk(self, ctxt, traffics, host):
+        self.cast(ctxt, self.make_msg('create_traffic_bulk',
+                traffics=traffics),
+                topic=_compute_topic(self.topic, ctxt, host, None),
+                version='2.4')
+
     def set_admin_password(self, ctxt, instance, new_pass):
         instance_p = jsonutils.to_primitive(instance)
         return self.call(ctxt, self.make_msg('set_admin_password',
@@ -0,0 +1,170 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Bandwidth statistics of the htb classes of this host.
+
+The counters of every class are sampled every ``traffic_stats_interval``
+seconds into fixed size ring buffers.  All classes of an interface share
+one ring of sample times and each class owns a single flat array of
+``traffic_stats_samples`` x 4 doubles (bytes, packets, drops, overlimits),
+so the memory used is ``32 * traffic_stats_samples`` bytes per class plus
+a small constant, whatever the sampling history.
+"""
+
+import array
+import time
+
+from traffic import flags
+from traffic.openstack.common import cfg
+from traffic.openstack.common import log as logging
+from traffic.tqdisc import parser
+
+
+LOG = logging.getLogger(__name__)
+
+stats_opts = [
+    cfg.IntOpt('traffic_stats_interval',
+               default=10,
+               help='Seconds between two samples of the tc class counters. '
+                    'Set to 0 to disable the statistics.'),
+    cfg.IntOpt('traffic_stats_samples',
+               default=60,
+               help='Number of samples kept per tc class'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(stats_opts)
+
+# counters kept per sample, in this order
+COUNTERS = ('bytes', 'packets', 'drops', 'overlimits')
+_WIDTH = len(COUNTERS)
+
+
+class _Ring(object):
+    """Counter history of one class."""
+
+    __slots__ = ('first', 'rate', 'ceil', 'values')
+
+    def __init__(self, first, samples):
+        self.first = first
+        self.rate = None
+        self.ceil = None
+        self.values = array.array('d', [0.0]) * (samples * _WIDTH)
+
+
+class StatsHistory(object):
+    """Ring buffers of the counters of all classes of one interface."""
+
+    def __init__(self, samples=None):
+        self.samples = samples or FLAGS.traffic_stats_samples
+        self.times = array.array('d', [0.0]) * self.samples
+        # number of sweeps recorded so far; sweep n lives in slot
+        # n % samples
+        self.sweeps = 0
+        self._rings = {}
+
+    def __len__(self):
+        return len(self._rings)
+
+    def record(self, now, records):
+        """Store one sweep of :class:`traffic.tqdisc.parser.TcClass`."""
+        sweep = self.sweeps
+        slot = (sweep % self.samples) * _WIDTH
+        previous = ((sweep - 1) % self.samples) * _WIDTH
+        self.times[sweep % self.samples] = now
+        rings = {}
+        for record in records:
+            ring = self._rings.get(record.handle)
+            if ring is not None and ring.first < sweep and \
+                    record.bytes < ring.values[previous]:
+                # the class was deleted and created again in between
+                ring = None
+            if ring is None:
+                ring = _Ring(sweep, self.samples)
+            ring.rate = record.rate
+            ring.ceil = record.ceil
+            values = ring.values
+            values[slot] = record.bytes
+            values[slot + 1] = record.packets
+            values[slot + 2] = record.drops
+            values[slot + 3] = record.overlimits
+            rings[record.handle] = ring
+        self._rings = rings
+        self.sweeps = sweep + 1
+
+    def summary(self, classid, window=None):
+        """Return the rates of a class over the last window seconds.
+
+        The window is rounded to the samples available; None uses the
+        whole history.  Returns None for an unknown class.
+        """
+        ring = self._rings.get(classid)
+        if ring is None:
+            return None
+        last = self.sweeps - 1
+        # the oldest slot is skipped, a sweep in progress overwrites it
+        oldest = max(ring.first, self.sweeps - self.samples + 1)
+        end = self.times[last % self.samples]
+        start = last
+        while start > oldest:
+            then = self.times[(start - 1) % self.samples]
+            if window is not None and end - then > window:
+                break
+            start -= 1
+
+        elapsed = end - self.times[start % self.samples]
+        a = (start % self.samples) * _WIDTH
+        b = (last % self.samples) * _WIDTH
+        delta = [ring.values[b + i] - ring.values[a + i]
+                 for i in xrange(_WIDTH)]
+        result = {'classid': classid,
+                  'rate': ring.rate,
+                  'ceil': ring.ceil,
+                  'samples': last - start + 1,
+                  'window': elapsed,
+                  'bytes': delta[0],
+                  'packets': delta[1],
+                  'drops': delta[2],
+                  'overlimits': delta[3],
+                  'bps': None,
+                  'pps': None,
+                  'utilization': None,
+                  'drop_ratio': None}
+        if elapsed > 0:
+            result['bps'] = delta[0] * 8 / elapsed
+            result['pps'] = delta[1] / elapsed
+            if ring.rate:
+                result['utilization'] = result['bps'] / ring.rate
+        if delta[1] + delta[2] > 0:
+            result['drop_ratio'] = delta[2] / (delta[1] + delta[2])
+        return result
+
+
+class StatsCollector(object):
+    """Sample the class counters of an interface into a history."""
+
+    def __init__(self, interface, samples=None):
+        self.interface = interface
+        self.history = StatsHistory(samples)
+
+    def sample(self):
+        try:
+            self.history.record(time.time(),
+                                parser.show_classes(self.interface))
+        except Exception:
+            LOG.exception(_('Failed to sample the tc classes of %s'),
+                          self.interface)
+
+    def summary(self, classid, window=None):
+        return self.history.summary(classid, window)
@@ -0,0 +1,344 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Batched programming of the kernel traffic control tree.
+
+A :class:`TcBatch` collects qdisc, class and filter operations and hands
+all of them to the tc driver selected by the ``tc_driver`` flag when
+flushed.  The default :class:`TcBatchDriver` applies them with a single
+``tc -force -batch -`` process; see :mod:`traffic.compute.netlink` for the
+rtnetlink driver.  Every operation carries a tag, normally
+``('tqdisc', instance_id)`` or ``('tfilter', instance_id)``, so that the
+caller can map each failed command back to the database row it belongs to.
+
+:class:`TcBatchQueue` coalesces the batches submitted by concurrent
+requests on one host so that they share a single flush per window.
+"""
+
+import re
+import sys
+
+from eventlet import event
+from eventlet import greenthread
+
+from traffic.compute import executor
+from traffic import flags
+from traffic.openstack.common import cfg
+from traffic.openstack.common import importutils
+from traffic.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+tc_batch_opts = [
+    cfg.FloatOpt('tc_batch_window',
+                 default=0.05,
+                 help='Seconds to collect tc operations from concurrent '
+                      'requests before flushing them through one tc -batch '
+                      'process'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(tc_batch_opts)
+
+# tc -force prints this after the error message of every failed line
+_FAILED_RE = re.compile(r'^Command failed (?:\S+):(\d+)\s*$')
+
+_DRIVER = None
+
+
+def get_driver():
+    """Return the process wide tc driver selected by FLAGS.tc_driver."""
+    global _DRIVER
+    if _DRIVER is None:
+        _DRIVER = importutils.import_object(FLAGS.tc_driver)
+    return _DRIVER
+
+
+class TcCommand(object):
+    """A single tc operation.
+
+    ``obj`` is one of 'qdisc', 'class' or 'filter' and ``action`` one of
+    the tc verbs ('add', 'change', 'replace', 'del').  ``opts`` holds the
+    object parameters; see :meth:`TcBatch.add_filter` for the keys.
+    """
+
+    __slots__ = ('obj', 'action', 'dev', 'opts', 'tag')
+
+    def __init__(self, obj, action, dev, opts, tag=None):
+        self.obj = obj
+        self.action = action
+        self.dev = dev
+        self.opts = opts
+        self.tag = tag
+
+    def args(self):
+        """Render the command as tc arguments (without the 'tc' itself)."""
+        opts = self.opts
+        args = [self.obj, self.action, 'dev', self.dev]
+        if self.obj == 'qdisc':
+            parent = opts.get('parent', 'root')
+            if parent in ('root', 'ingress'):
+                args.append(parent)
+            else:
+                args.extend(['parent', parent])
+            # the ingress qdisc always gets handle ffff:
+            if opts.get('handle') and parent != 'ingress':
+                args.extend(['handle', opts['handle']])
+            if self.action != 'del' and parent != 'ingress':
+                args.append(opts.get('kind', 'htb'))
+                if opts.get('default') is not None:
+                    args.extend(['default', opts['default']])
+        elif self.obj == 'class':
+            if opts.get('parent'):
+                args.extend(['parent', opts['parent']])
+            args.extend(['classid', opts['classid']])
+            if self.action != 'del':
+                args.extend(['htb', 'rate', opts['rate']])
+                if opts.get('ceil'):
+                    args.extend(['ceil', opts['ceil']])
+                if opts.get('prio') is not None:
+                    args.extend(['prio', opts['prio']])
+                elif self.action == 'change':
+                    # change rebuilds the htb options, spell out the default
+                    # rather than leave it implied
+                    args.extend(['prio', 0])
+        else:
+            args.extend(['parent', opts['parent']])
+            if self.action != 'del':
+                args.extend(['protocol', opts.get('protocol', 'ip')])
+            args.extend(['prio', opts['prio']])
+            if opts.get('handle'):
+                args.extend(['handle', opts['handle']])
+            args.append('u32')
+            if self.action != 'del' and opts.get('divisor'):
+                args.extend(['divisor', opts['divisor']])
+            elif self.action != 'del':
+                if opts.get('ht'):
+                    args.extend(['ht', opts['ht']])
+                for field, value in opts.get('match', ()):
+                    args.extend(['match', 'ip', field, value])
+                if opts.get('hashkey'):
+                    mask, offset = opts['hashkey']
+                    args.extend(['hashkey', 'mask', '0x%08x' % mask,
+                                 'at', offset])
+                if opts.get('link'):
+                    args.extend(['link', opts['link']])
+                if opts.get('police'):
+                    rate, burst = opts['police']
+                    args.extend(['police', 'rate', rate, 'burst', burst,
+                                 'drop'])
+                if opts.get('flowid'):
+                    args.extend(['flowid', opts['flowid']])
+        return [str(arg) for arg in args]
+
+    def __str__(self):
+        return ' '.join(self.args())
+
+
+class TcResult(object):
+    """Outcome of one command of a flushed batch."""
+
+    __slots__ = ('command', 'error')
+
+    def __init__(self, command, error=None):
+        self.command = command
+        self.error = error
+
+    @property
+    def tag(self):
+        return self.command.tag
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class TcDriver(object):
+    """Interface of the backends that program the tc tree."""
+
+    def apply(self, commands):
+        """Apply a list of :class:`TcCommand` in order.
+
+        A failing command must not stop the ones after it.  Returns one
+        :class:`TcResult` per command, in the same order.
+        """
+        raise NotImplementedError()
+
+
+class TcBatchDriver(TcDriver):
+    """Driver feeding the commands to a single tc -batch process."""
+
+    def __init__(self, execute=None):
+        self._execute = execute or executor.get_executor().execute
+
+    def apply(self, commands):
+        script = ''.join('%s\n' % command for command in commands)
+        _out, err = self._execute('tc', '-force', '-batch', '-',
+                                  process_input=script,
+                                  run_as_root=True,
+                                  check_exit_code=False)
+        return _parse_results(commands, err)
+
+
+class TcBatch(object):
+    """Ordered collection of tc operations applied in one go."""
+
+    def __init__(self, driver=None):
+        self.driver = driver
+        self.commands = []
+
+    def _queue(self, obj, action, dev, tag, opts):
+        self.commands.append(TcCommand(obj, action, dev, opts, tag))
+
+    def add_qdisc(self, dev, handle, kind='htb', parent='root',
+                  default=None, tag=None):
+        self._queue('qdisc', 'add', dev, tag,
+                    {'handle': handle, 'kind': kind, 'parent': parent,
+                     'default': default})
+
+    def del_qdisc(self, dev, parent='root', tag=None):
+        self._queue('qdisc', 'del', dev, tag, {'parent': parent})
+
+    def add_class(self, dev, parent, classid, rate, ceil=None, prio=None,
+                  tag=None):
+        self._queue('class', 'add', dev, tag,
+                    {'parent': parent, 'classid': classid, 'rate': rate,
+                     'ceil': ceil, 'prio': prio})
+
+    def change_class(self, dev, parent, classid, rate, ceil=None, prio=None,
+                     tag=None):
+        self._queue('class', 'change', dev, tag,
+                    {'parent': parent, 'classid': classid, 'rate': rate,
+                     'ceil': ceil, 'prio': prio})
+
+    def del_class(self, dev, classid, tag=None):
+        self._queue('class', 'del', dev, tag, {'classid': classid})
+
+    def add_filter(self, dev, parent, prio, match=(), flowid=None,
+                   handle=None, police=None, ht=None, link=None,
+                   hashkey=None, tag=None):
+        """Queue a u32 filter.
+
+        :param match: sequence of (field, value) pairs, e.g.
+                      ``[('src', '10.0.0.3/32')]``
+        :param police: optional (rate, burst) tuple; matching packets
+                       above rate are dropped
+        :param ht: hash table (and bucket) to insert the filter into,
+                   e.g. ``'1:2a:'``
+        :param link: hash table that matching packets are passed on to
+        :param hashkey: (mask, offset) of the header word hashed to pick
+                        the bucket of the linked table
+        """
+        self._queue('filter', 'add', dev, tag,
+                    {'parent': parent, 'prio': prio, 'match': match,
+                     'flowid': flowid, 'handle': handle, 'police': police,
+                     'ht': ht, 'link': link, 'hashkey': hashkey})
+
+    def add_hashtable(self, dev, parent, prio, handle, divisor=256,
+                      tag=None):
+        """Queue a u32 hash table with divisor buckets."""
+        self._queue('filter', 'add', dev, tag,
+                    {'parent': parent, 'prio': prio, 'handle': handle,
+                     'divisor': divisor})
+
+    def del_filter(self, dev, parent, prio, handle, tag=None):
+        self._queue('filter', 'del', dev, tag,
+                    {'parent': parent, 'prio': prio, 'handle': handle})
+
+    def extend(self, other):
+        """Move all commands of another batch to the end of this one."""
+        self.commands.extend(other.commands)
+        other.commands = []
+
+    def flush(self):
+        """Apply every queued command and empty the batch.
+
+        Returns one :class:`TcResult` per command, in queue order.
+        """
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+
+        LOG.debug(_('Flushing %d tc commands'), len(commands))
+        return (self.driver or get_driver()).apply(commands)
+
+
+def _parse_results(commands, stderr):
+    """Assign the error messages in tc -batch stderr to their commands."""
+    errors = {}
+    message = []
+    for line in (stderr or '').splitlines():
+        match = _FAILED_RE.match(line)
+        if match:
+            errors[int(match.group(1)) - 1] = ' '.join(message) or line
+            message = []
+        elif line.strip():
+            message.append(line.strip())
+    return [TcResult(command, errors.get(index))
+            for index, command in enumerate(commands)]
+
+
+def log_failures(results):
+    """Log every failed command and return the failed results."""
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        LOG.error(_('tc command for %(tag)s failed: %(command)s: %(error)s'),
+                  {'tag': result.tag, 'command': result.command,
+                   'error': result.error})
+    return failed
+
+
+class TcBatchQueue(object):
+    """Host wide queue sharing one tc -batch process per flush window.
+
+    Batches submitted while a flush is pending are merged into it; every
+    submitter blocks until the merged batch is applied and gets back the
+    results of its own commands only.
+    """
+
+    def __init__(self, window=None):
+        if window is None:
+            window = FLAGS.tc_batch_window
+        self.window = window
+        self._pending = []
+        self._batch = TcBatch()
+        self._timer = None
+
+    def submit(self, batch):
+        if not batch.commands:
+            return []
+        done = event.Event()
+        self._pending.append((len(batch.commands), done))
+        self._batch.extend(batch)
+        if self._timer is None:
+            self._timer = greenthread.spawn_after(self.window, self._flush)
+        return done.wait()
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        batch, self._batch = self._batch, TcBatch()
+        self._timer = None
+        try:
+            results = batch.flush()
+        except Exception:
+            exc_info = sys.exc_info()
+            for _count, done in pending:
+                done.send_exception(*exc_info)
+            return
+
+        offset = 0
+        for count, done in pending:
+            done.send(results[offset:offset + count])
+            offset += count
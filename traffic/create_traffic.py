@@ -22,7 +22,10 @@ def main():
                                         handle int,
                                         ip varchar(25),
                                         flowid varchar(10),
-                                        prio int )'''
+                                        prio int,
+                                        unique key uniq_tfilter0host0handle (host, handle),
+                                        key tfilter_ip_idx (ip),
+                                        key tfilter_instanceid_idx (instanceid) )'''
     
     cursor.execute(tfilter_sql)
     
@@ -39,9 +42,32 @@ def main():
                                           ip varchar(25),
                                           host varchar(100),
                                           band varchar(15),
-                                          prio int)'''
+                                          prio int,
+                                          unique key uniq_tqdisc0host0classid (host, classid),
+                                          key tqdisc_ip_idx (ip),
+                                          key tqdisc_instanceid_idx (instanceid))'''
     
     cursor.execute(tqdisc_sql)
+
+    traffic_rules_sql = '''create table traffic_rules(
+                                          id int not null primary key auto_increment,
+                                          created_at datetime default null,
+                                          updated_at datetime default null,
+                                          deleted_at datetime default null,
+                                          deleted varchar(36),
+                                          instanceid varchar(50),
+                                          host varchar(100),
+                                          ip varchar(25),
+                                          classid varchar(20),
+                                          handle int,
+                                          prio int,
+                                          band varchar(15),
+                                          unique key uniq_traffic_rules0host0classid (host, classid),
+                                          unique key uniq_traffic_rules0host0handle (host, handle),
+                                          key traffic_rules_ip_idx (ip),
+                                          key traffic_rules_instanceid_idx (instanceid))'''
+
+    cursor.execute(traffic_rules_sql)
     
     db.commit()
 
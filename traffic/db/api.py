@@ -93,26 +93,83 @@ def tqdisc_create(context, values):
     'create tqdisc'
     return IMPL.tqdisc_create(context, values)
 
-def tqdisc_get(context, id):
+def traffic_rule_create(context, values):
+    'create the rule of an instance in one transaction'
+    return IMPL.traffic_rule_create(context, values)
+
+def traffic_rule_create_many(context, values_list):
+    'create many rules in one transaction'
+    return IMPL.traffic_rule_create_many(context, values_list)
+
+def traffic_rule_delete_many(context, instance_ids):
+    'delete the rules of many instances in one transaction'
+    return IMPL.traffic_rule_delete_many(context, instance_ids)
+
+def traffic_rule_get_by_instance(context, instanceid):
+    'get the rule of an instance'
+    return IMPL.traffic_rule_get_by_instance(context, instanceid)
+
+def traffic_rule_get_all_by_host(context, host):
+    'get all rules of a host'
+    return IMPL.traffic_rule_get_all_by_host(context, host)
+
+def traffic_rule_delete_by_instance(context, instanceid):
+    'delete the rule of an instance'
+    return IMPL.traffic_rule_delete_by_instance(context, instanceid)
+
+def traffic_rule_update_handle(context, id, handle):
+    'move the filter of a rule to another u32 handle'
+    return IMPL.traffic_rule_update_handle(context, id, handle)
+
+def traffic_rule_get_by_mac(context, mac):
+    'get the rule of the instance with a nic of this mac'
+    return IMPL.traffic_rule_get_by_mac(context, mac)
+
+def traffic_rule_move(context, id, host, classid, handle):
+    'move a rule to another host'
+    return IMPL.traffic_rule_move(context, id, host, classid, handle)
+
+def tqdisc_get(context, id, use_slave=False):
     'get a tqdisc'
-    return IMPL.tqdisc_get(context, id)
+    return IMPL.tqdisc_get(context, id, use_slave=use_slave)
 
 def get_classid(context):
     'get a classid'
     return IMPL.tqdisc_get_classid(context)
 
-def get_classid_by_instance(context, instanceid):
-    return IMPL.get_classid_by_instance(context, instanceid)
+def tqdisc_get_classids_by_host(context, host):
+    'get the classids of the tqdiscs of a host'
+    return IMPL.tqdisc_get_classids_by_host(context, host)
 
-def tqdisc_get_all(context):
+def tqdisc_get_all_by_host(context, host):
+    'get all tqdisc of a host'
+    return IMPL.tqdisc_get_all_by_host(context, host)
+
+def get_classid_by_instance(context, instanceid, use_slave=False):
+    return IMPL.get_classid_by_instance(context, instanceid,
+                                        use_slave=use_slave)
+
+def tqdisc_get_all(context, use_slave=False):
     'get all tqdisc'
-    return IMPL.tqdisc_get_all(context)
+    return IMPL.tqdisc_get_all(context, use_slave=use_slave)
+
+def tqdisc_get_all_by_filters(context, filters=None, limit=None, marker=None,
+                              use_slave=False):
+    'get a page of the tqdiscs matching filters'
+    return IMPL.tqdisc_get_all_by_filters(context, filters, limit, marker,
+                                          use_slave=use_slave)
+
+def tqdisc_get_all_iter(context, filters=None, batch=1000, use_slave=False):
+    'iterate over all the tqdiscs matching filters'
+    return IMPL.tqdisc_get_all_iter(context, filters, batch,
+                                    use_slave=use_slave)
 
-def tqdisc_get_by_instance_id(context, instance_id):
-    return IMPL.tqdisc_get_by_instance_id(context, instance_id)
+def tqdisc_get_by_instance_id(context, instance_id, use_slave=False):
+    return IMPL.tqdisc_get_by_instance_id(context, instance_id,
+                                          use_slave=use_slave)
 
-def tqdisc_get_by_ip(context, ip):
-    return IMPL.tqdisc_get_by_ip(context, ip)
+def tqdisc_get_by_ip(context, ip, use_slave=False):
+    return IMPL.tqdisc_get_by_ip(context, ip, use_slave=use_slave)
 
 def tqdisc_get_host(context, classid):
     return IMPL.tqdisc_get_host(context, classid)
@@ -126,6 +183,10 @@ def get_host_by_instance(context, instanceid):
 def get_mac_by_instance(context, instanceid):
     return IMPL.get_mac_by_instance(context, instanceid)
 
+def instance_network_info_get_many(context, instance_ids):
+    'get the host, mac and ip of many instances at once'
+    return IMPL.instance_network_info_get_many(context, instance_ids)
+
 def tqdisc_delete(context, id):
     'delete a tqdisc'
     return IMPL.tqdisc_delete(context, id)
@@ -137,6 +198,10 @@ def tqdisc_delete_by_classid(context, classid):
 def tqdisc_delete_by_instanceid(context, instance_id):
     return IMPL.tqdisc_delete_by_instanceid(context, instance_id)
 
+def tqdisc_update_by_instanceid(context, instance_id, band, prio=None):
+    'change the band and prio of the tqdisc of an instance'
+    return IMPL.tqdisc_update_by_instanceid(context, instance_id, band, prio)
+
 def get_host_by_instance_id(context, instance_id):
     return IMPL.get_host_by_instance_id(context, instance_id)
 
@@ -144,6 +209,10 @@ def tfilter_get_last_handle(context, host):
     'get a last handle of tfilter'
     return IMPL.tfilter_get_last_handle(context, host)
 
+def tfilter_get_all_by_host(context, host):
+    'get all tfilter of a host'
+    return IMPL.tfilter_get_all_by_host(context, host)
+
 def tfilter_create(context, values):
     'create a tfilter'
     return IMPL.tfilter_create(context, values)
@@ -155,6 +224,10 @@ def tfilter_get_by_classid(context, classid):
 def tfilter_get_by_instance(context, instanceid):
     return IMPL.tfilter_get_by_instance(context, instanceid)
 
+def tfilter_get_by_ip(context, ip, use_slave=False):
+    'get a tfilter by ip'
+    return IMPL.tfilter_get_by_ip(context, ip, use_slave=use_slave)
+
 def tfilter_get(context, id):
     'get a tfilter'
     return IMPL.tfilter_get(context, id)
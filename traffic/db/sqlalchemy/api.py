@@ -29,6 +29,7 @@ import warnings
 from traffic.common.sqlalchemyutils import paginate_query
 from traffic import db
 from traffic.db.sqlalchemy import models
+from traffic.db.sqlalchemy.session import get_engine
 from traffic.db.sqlalchemy.session import get_session
 from traffic import exception
 from traffic import flags
@@ -41,8 +42,10 @@ from sqlalchemy import or_
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql.expression import asc
+from sqlalchemy.sql.expression import bindparam
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import literal_column
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
 
 FLAGS = flags.FLAGS
@@ -194,8 +197,11 @@ def model_query(context, model, *args, **kwargs):
     :param project_only: if present and context is user-type, then restrict
             query to match the context's project_id. If set to 'allow_none',
             restriction includes project_id = None.
+    :param use_slave: if present and no session is given, read from the
+            slave_connection database if one is configured.
     """
-    session = kwargs.get('session') or get_session()
+    session = kwargs.get('session') or \
+              get_session(use_slave=kwargs.get('use_slave', False))
     read_deleted = kwargs.get('read_deleted') or context.read_deleted
     project_only = kwargs.get('project_only', False)
 
@@ -716,68 +722,303 @@ def floating_ip_allocate_address(context, project_id, pool):
 
 @require_context
 def tqdisc_create(context, values, session=None):
+    """Create a rule without filter, returns its classid."""
+    rule_ref = traffic_rule_create(context, values, session=session)
+    return rule_ref['classid']
+
+@require_context
+def traffic_rule_create(context, values, session=None):
+    """Create the class and filter rule of an instance in one transaction."""
     if not session:
         session = get_session()
     with session.begin():
-        tqdisc_ref = models.Tqdisc()
-        tqdisc_ref.update(values)
-    
-        tqdisc_ref.save(session=session)
-    return tqdisc_ref['classid']     
+        rule_ref = models.TrafficRule()
+        rule_ref.update(values)
+        rule_ref.save(session=session)
+    return rule_ref
+
+###################
+
+
+# The traffic lookups below run on every create/delete and reconcile.  Their
+# statements are built once with bound parameters and compiled once per
+# engine into _COMPILED_CACHES.
+
+_rules = models.TrafficRule.__table__
+_instances = models.Instance.__table__
+_vifs = models.VirtualInterface.__table__
+_fixed_ips = models.FixedIp.__table__
+_floating_ips = models.FloatingIp.__table__
+
+# column order of the former tqdisc table; callers index the tqdisc rows by
+# position
+_TQDISC_COLUMNS = [_rules.c[name] for name in
+                   ('id', 'created_at', 'updated_at', 'deleted_at',
+                    'deleted', 'instanceid', 'classid', 'ip', 'host', 'band',
+                    'prio')]
+
+_STATEMENTS = {
+    'rule_last_classid':
+        select([_rules.c.classid]).order_by(desc(_rules.c.id)).limit(1),
+    'rule_classids_by_host':
+        select([_rules.c.classid], _rules.c.host == bindparam('host')),
+    'rule_by_host':
+        select([_rules], _rules.c.host == bindparam('host')),
+    'rule_by_instance':
+        select([_rules], _rules.c.instanceid == bindparam('instanceid')),
+    'rule_classid_by_instance':
+        select([_rules.c.classid],
+               _rules.c.instanceid == bindparam('instanceid')),
+    'rule_last_handle':
+        select([_rules.c.handle], and_(_rules.c.host == bindparam('host'),
+                                       _rules.c.handle != None),
+               order_by=[desc(_rules.c.id)], limit=1),
+    'rule_delete_by_instance':
+        _rules.delete().where(_rules.c.instanceid == bindparam('instanceid')),
+    'rule_by_mac':
+        select([_rules], and_(_vifs.c.address == bindparam('address'),
+                              _vifs.c.deleted == False),
+               from_obj=[_rules.join(
+                   _vifs, _vifs.c.instance_uuid == _rules.c.instanceid)],
+               limit=1),
+    'tqdisc_all':
+        select(_TQDISC_COLUMNS),
+    'tqdisc_by_host':
+        select(_TQDISC_COLUMNS, _rules.c.host == bindparam('host')),
+    'tqdisc_by_instance':
+        select(_TQDISC_COLUMNS,
+               _rules.c.instanceid == bindparam('instanceid')),
+    'tfilter_by_host':
+        select([_rules], and_(_rules.c.host == bindparam('host'),
+                              _rules.c.handle != None)),
+    # the parameters of updates must not be named after a column, those
+    # would be added to the SET clause
+    'rule_update_band':
+        _rules.update().where(
+            _rules.c.instanceid == bindparam('rule_instanceid')).values(
+                band=bindparam('new_band'), updated_at=bindparam('now')),
+    'rule_update_band_prio':
+        _rules.update().where(
+            _rules.c.instanceid == bindparam('rule_instanceid')).values(
+                band=bindparam('new_band'), prio=bindparam('new_prio'),
+                updated_at=bindparam('now')),
+    'rule_update_handle':
+        _rules.update().where(_rules.c.id == bindparam('rule_id')).values(
+            handle=bindparam('new_handle'), updated_at=bindparam('now')),
+    'rule_update_handle_by_instance':
+        _rules.update().where(
+            _rules.c.instanceid == bindparam('rule_instanceid')).values(
+                handle=bindparam('new_handle'), updated_at=bindparam('now')),
+    'rule_move':
+        _rules.update().where(_rules.c.id == bindparam('rule_id')).values(
+            host=bindparam('new_host'), classid=bindparam('new_classid'),
+            handle=bindparam('new_handle'), updated_at=bindparam('now')),
+    'instance_host':
+        select([_instances.c.host],
+               _instances.c.uuid == bindparam('instanceid')),
+    'instance_mac':
+        select([_vifs.c.address],
+               _vifs.c.instance_uuid == bindparam('instanceid')),
+    'instance_floating_ip':
+        select([_floating_ips.c.address],
+               _fixed_ips.c.instance_uuid == bindparam('instanceid'),
+               from_obj=[_fixed_ips.join(
+                   _floating_ips,
+                   _floating_ips.c.fixed_ip_id == _fixed_ips.c.id)]),
+}
+
+# bound to stay below the parameter limit of the drivers
+_MAX_IN_PARAMS = 500
+
+# the network info of a chunk of instances is read with the smallest of
+# these IN lists it fits in, padded with its last id, so that a handful of
+# statements cover any number of instances
+_NETWORK_INFO_SIZES = (1, 8, 64, _MAX_IN_PARAMS)
+
+
+def _network_info_statement(size):
+    return select(
+        [_instances.c.uuid, _instances.c.host, _vifs.c.address,
+         _floating_ips.c.address],
+        and_(_instances.c.uuid.in_([bindparam('id%d' % index)
+                                    for index in xrange(size)]),
+             _instances.c.deleted == False),
+        from_obj=[_instances.outerjoin(
+            _vifs, and_(_vifs.c.instance_uuid == _instances.c.uuid,
+                        _vifs.c.deleted == False)).outerjoin(
+            _fixed_ips, and_(_fixed_ips.c.instance_uuid == _instances.c.uuid,
+                             _fixed_ips.c.deleted == False)).outerjoin(
+            _floating_ips, and_(
+                _floating_ips.c.fixed_ip_id == _fixed_ips.c.id,
+                _floating_ips.c.deleted == False))])
+
+for _size in _NETWORK_INFO_SIZES:
+    _STATEMENTS['instance_network_info_%d' % _size] = \
+        _network_info_statement(_size)
+
+_COMPILED_CACHES = {}
+
+
+def _execute(name, use_slave=False, **params):
+    """Execute one of _STATEMENTS with params, reusing its compiled form.
+
+    The connection goes back to the pool once the result is exhausted or
+    closed.  use_slave runs reads on the slave_connection database.
+    """
+    engine = get_engine(use_slave=use_slave)
+    connection = engine.contextual_connect(close_with_result=True)
+    connection = connection.execution_options(
+        compiled_cache=_COMPILED_CACHES.setdefault(engine, {}))
+    return connection.execute(_STATEMENTS[name], **params)
+
+
+def _execute_many(statements):
+    """Run (statement, params) pairs in a single transaction."""
+    connection = get_engine().connect()
+    try:
+        with connection.begin():
+            for statement, params in statements:
+                connection.execute(statement, params)
+    finally:
+        connection.close()
+
+
+def _rowcount(result):
+    rowcount = result.rowcount
+    result.close()
+    return rowcount
+
+
+@require_context
+def traffic_rule_create_many(context, values_list):
+    """Insert many rules with one executemany and one commit."""
+    if values_list:
+        _execute_many([(_rules.insert(), list(values_list))])
+
+@require_context
+def traffic_rule_delete_many(context, instance_ids):
+    """Delete the rules of instances in one transaction."""
+    instance_ids = list(instance_ids)
+    statements = []
+    for start in xrange(0, len(instance_ids), _MAX_IN_PARAMS):
+        chunk = instance_ids[start:start + _MAX_IN_PARAMS]
+        statements.append((_rules.delete().where(
+            _rules.c.instanceid.in_(chunk)), {}))
+    if statements:
+        _execute_many(statements)
+
+@require_context
+def traffic_rule_get_by_instance(context, instanceid):
+    """Return the rule of an instance, or None."""
+    return _execute('rule_by_instance', instanceid=instanceid).first()
+
+@require_context
+def traffic_rule_get_all_by_host(context, host):
+    return _execute('rule_by_host', host=host).fetchall()
+
+@require_context
+def traffic_rule_delete_by_instance(context, instanceid):
+    """Delete the rule of an instance, returns the number of rows deleted."""
+    return _rowcount(_execute('rule_delete_by_instance',
+                              instanceid=instanceid))
+
+@require_context
+def traffic_rule_update_handle(context, id, handle):
+    return _rowcount(_execute('rule_update_handle', rule_id=id,
+                              new_handle=handle, now=timeutils.utcnow()))
+
+@require_context
+def traffic_rule_get_by_mac(context, mac):
+    """Return the rule of the instance with a nic of this mac, or None.
+
+    mac may also be the one of the tap of the nic, libvirt turns the fa
+    first octet the vifs are created with into fe there.
+    """
+    return _execute('rule_by_mac', address='fa' + mac.lower()[2:]).first()
+
+@require_context
+def traffic_rule_move(context, id, host, classid, handle):
+    """Move a rule to the class and filter set up for it on host."""
+    return _rowcount(_execute('rule_move', rule_id=id, new_host=host,
+                              new_classid=classid, new_handle=handle,
+                              now=timeutils.utcnow()))
 
 @require_context
 def tqdisc_get_classid(context):
-    session = get_session()
-    result = session.execute('select classid from tqdisc order by id desc limit 1').first()
-    return result
+    return _execute('rule_last_classid').first()
+
+@require_context
+def tqdisc_get_classids_by_host(context, host):
+    return _execute('rule_classids_by_host', host=host).fetchall()
+
+@require_context
+def tqdisc_get_all_by_host(context, host):
+    return _execute('tqdisc_by_host', host=host).fetchall()
+
+@require_context
+def tfilter_get_all_by_host(context, host):
+    return _execute('tfilter_by_host', host=host).fetchall()
 
 @require_context
 def tfilter_get_last_handle(context, host):
-    session = get_session()
-    result = session.execute('select handle from tfilter where host="'+host+'" order by id desc limit 1').first()
-    return result
+    return _execute('rule_last_handle', host=host).first()
 
 @require_context
 def tfilter_create(context, values, session=None):
-    if not session:
-        session = get_session()
-    with session.begin():
-        tfilter_ref = models.Tfilter()
-        tfilter_ref.update(values)
-        tfilter_ref.save(session=session)
-    
-    return tfilter_ref['id']
+    """Set the filter handle of the rule of values['instanceid']."""
+    _rowcount(_execute('rule_update_handle_by_instance',
+                       rule_instanceid=values['instanceid'],
+                       new_handle=values['handle'], now=timeutils.utcnow()))
+    return values['handle']
 
 @require_context
 def get_ip_by_instance(context, instanceid):
-    session = get_session()
-    result = session.execute('select id from fixed_ips where instance_uuid="'+instanceid+'"').first()
-    float_ip = session.execute('select address from floating_ips where fixed_ip_id='+str(result[0]))
-    return float_ip
+    return _execute('instance_floating_ip', instanceid=instanceid)
                 
 @require_context
 def get_host_by_instance(context, instanceid):
     #result = model_query(context, models.Instance, project_only=True).\
     #            filter_by(uuid=instanceid).first()
-    session = get_session()
-    result = session.execute('select host from instances where uuid="'+instanceid+'"').first()
-    return result
+    return _execute('instance_host', instanceid=instanceid).first()
 
 @require_context
 def get_mac_by_instance(context, instanceid):
-    session = get_session()
-    result = session.execute('select address from virtual_interfaces where instance_uuid="'+instanceid+'"').first()
-    return result 
+    return _execute('instance_mac', instanceid=instanceid).first()
 
 @require_context
-def get_classid_by_instance(context, instanceid):
-    session = get_session()
-    result = session.execute('select classid from tqdisc where instanceid ="'+instanceid+'"').first()
+def instance_network_info_get_many(context, instance_ids):
+    """Return {uuid: {'host', 'mac', 'ip'}} of instances.
+
+    One query per _MAX_IN_PARAMS instances; deleted instances, nics and
+    addresses are left out.
+    """
+    instance_ids = list(instance_ids)
+    result = {}
+    for start in xrange(0, len(instance_ids), _MAX_IN_PARAMS):
+        chunk = instance_ids[start:start + _MAX_IN_PARAMS]
+        size = min(size for size in _NETWORK_INFO_SIZES
+                   if size >= len(chunk))
+        chunk += chunk[-1:] * (size - len(chunk))
+        params = dict(('id%d' % index, instance_id)
+                      for index, instance_id in enumerate(chunk))
+        rows = _execute('instance_network_info_%d' % size, **params)
+        for uuid, host, mac, ip in rows:
+            info = result.setdefault(uuid,
+                                     {'host': host, 'mac': mac, 'ip': ip})
+            # an instance with several nics may come back more than once
+            info['mac'] = info['mac'] or mac
+            info['ip'] = info['ip'] or ip
     return result
 
 @require_context
-def tqdisc_get(context, id):
-    result = model_query(context, models.Tqdisc, project_only=True).\
+def get_classid_by_instance(context, instanceid, use_slave=False):
+    return _execute('rule_classid_by_instance', use_slave=use_slave,
+                    instanceid=instanceid).first()
+
+@require_context
+def tqdisc_get(context, id, use_slave=False):
+    result = model_query(context, models.TrafficRule, project_only=True,
+                         use_slave=use_slave).\
                  filter_by(id=id).\
                  first()
 
@@ -787,16 +1028,61 @@ def tqdisc_get(context, id):
     return result
 
 @require_context
-def tqdisc_get_all(context):
-    
-    session = get_session()
-    result = session.execute('select * from tqdisc')
+def tqdisc_get_all(context, use_slave=False):
+    return _execute('tqdisc_all', use_slave=use_slave)
 
-    return result
+@require_context
+def tqdisc_get_all_by_filters(context, filters=None, limit=None, marker=None,
+                              use_slave=False):
+    """Return a page of rules matching filters, ordered by id.
+
+    filters may hold exact values of host, ip and band; marker is the id
+    of the last rule of the previous page.
+    """
+    filters = dict(filters or {})
+    session = get_session(use_slave=use_slave)
+    # rules are deleted for real and carry no project
+    query = model_query(context, models.TrafficRule, session=session,
+                        read_deleted='yes')
+    query = exact_filter(query, models.TrafficRule, filters,
+                         ['host', 'ip', 'band'])
+    if marker is not None:
+        marker_ref = model_query(context, models.TrafficRule,
+                                 session=session, read_deleted='yes').\
+                         filter_by(id=marker).\
+                         first()
+        if not marker_ref:
+            raise exception.MarkerNotFound(marker=marker)
+        marker = marker_ref
+    query = paginate_query(query, models.TrafficRule, limit, ['id'],
+                           marker=marker)
+    return query.all()
+
+@require_context
+def tqdisc_get_all_iter(context, filters=None, batch=1000, use_slave=False):
+    """Yield the rules matching filters, in id order.
+
+    The table is walked in pages of batch rows keyed on id, so that at most
+    one page is held in memory whatever the driver buffers of a result.
+    """
+    query = select(_TQDISC_COLUMNS, _rules.c.id > bindparam('marker'),
+                   order_by=[_rules.c.id], limit=batch)
+    for key in ('host', 'ip', 'band'):
+        if filters and key in filters:
+            query = query.where(_rules.c[key] == filters[key])
+    engine = get_engine(use_slave=use_slave)
+    marker = 0
+    while True:
+        rows = engine.execute(query, marker=marker).fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < batch:
+            return
+        marker = rows[-1]['id']
 
 @require_context
 def tqdisc_get_all_bk(context):
-    result = model_query(context, models.Tqdisc, project_only=False).all()
+    result = model_query(context, models.TrafficRule, project_only=False).all()
     
     if not result:
         return None
@@ -813,7 +1099,7 @@ def get_host_by_instance_id(context, instance_id, session=None):
 
 @require_context
 def tqdisc_get_by_classid(context, classid):
-    result = model_query(context, models.Tqdisc, project_only=True).\
+    result = model_query(context, models.TrafficRule, project_only=True).\
                  filter_by(classid=classid).\
                  first()
     if not result:
@@ -822,15 +1108,23 @@ def tqdisc_get_by_classid(context, classid):
     return result
 
 @require_context
-def tqdisc_get_by_instance_id(context, instance_id):
-    session = get_session()
-    result = session.execute('select * from tqdisc where instanceid=\"'+instance_id+'\"')
+def tqdisc_get_by_instance_id(context, instance_id, use_slave=False):
+    return _execute('tqdisc_by_instance', use_slave=use_slave,
+                    instanceid=instance_id)
 
+@require_context
+def tqdisc_get_by_ip(context, ip, use_slave=False):
+    result = model_query(context, models.TrafficRule, read_deleted='yes',
+                         use_slave=use_slave).\
+                 filter_by(ip=ip).\
+                 first()
+    if not result:
+        raise exception.NoTqdisc(tqdisc=ip)
     return result
 
 @require_context
 def tqdisc_get_by_instance_idbk(context, instanceid):
-    result = model_query(context, models.Tqdisc, project_only=False).\
+    result = model_query(context, models.TrafficRule, project_only=False).\
                  filter_by(instanceid=instanceid).\
                  first()
     if not result:
@@ -852,8 +1146,16 @@ def tqdisc_delete_by_classid(context, classid):
         tqdisc_ref.delete(session=session)
 @require_context
 def tqdisc_delete_by_instanceid(context, instanceid):
-    session = get_session()
-    session.execute('delete from tqdisc where instanceid=\"'+instanceid+'\"')
+    return traffic_rule_delete_by_instance(context, instanceid)
+
+@require_context
+def tqdisc_update_by_instanceid(context, instanceid, band, prio=None):
+    values = {'rule_instanceid': instanceid, 'new_band': band,
+              'now': timeutils.utcnow()}
+    if prio is None:
+        return _rowcount(_execute('rule_update_band', **values))
+    return _rowcount(_execute('rule_update_band_prio', new_prio=prio,
+                              **values))
 
 @require_context
 def tqdisc_get_host(context, classid):
@@ -864,7 +1166,7 @@ def tqdisc_get_host(context, classid):
     
 @require_context
 def tfilter_get_by_classid(context, classid):
-    result = model_query(context, models.Tfilter, project_only=True).\
+    result = model_query(context, models.TrafficRule, project_only=True).\
                  filter_by(classid=classid).\
                  first()
     if not result:
@@ -873,18 +1175,14 @@ def tfilter_get_by_classid(context, classid):
 
 @require_context
 def tfilter_get_by_instance(context, instanceid):
-    session = get_session()
-    result = session.execute('select * from tfilter where instanceid="'+instanceid+'"').first()
-#    result = model_query(context, models.Tfilter, project_only=False).\
-#                 filter_by(instanceid=instanceid).\
-#                 first()
-#    if not result:
-#        raise exception.NoTfilter(instanceid=instanceid)
+    result = traffic_rule_get_by_instance(context, instanceid)
+    if result is None or result['handle'] is None:
+        return None
     return result
     
 @require_context
 def tfilter_get(context, id):
-    result = model_query(context, models.Tfilter, project_only=True).\
+    result = model_query(context, models.TrafficRule, project_only=True).\
                  filter_by(id=id).\
                  first()
     if not result:
@@ -892,8 +1190,9 @@ def tfilter_get(context, id):
     return result
 
 @require_context
-def tfilter_get_by_ip(context, ip):
-    result = model_query(context, models.Tfilter, project_only=True).\
+def tfilter_get_by_ip(context, ip, use_slave=False):
+    result = model_query(context, models.TrafficRule, project_only=True,
+                         use_slave=use_slave).\
                  filter_by(ip=ip).\
                  first()
     if not result:
@@ -902,8 +1201,8 @@ def tfilter_get_by_ip(context, ip):
 
 @require_context
 def tfilter_get_by_flow_id(context, flow_id):
-    result = model_query(context, models.Tfilter, project_only=True).\
-                 filter_by(flow_id=flow_id).\
+    result = model_query(context, models.TrafficRule, project_only=True).\
+                 filter_by(classid=flow_id).\
                  first()
     if not result:
         raise exception.NoTfilter(id=id)
@@ -911,7 +1210,7 @@ def tfilter_get_by_flow_id(context, flow_id):
 
 @require_context
 def tfilter_get_by_handle(context, handle):
-    result = model_query(context, models.Tfilter, project_only=True).\
+    result = model_query(context, models.TrafficRule, project_only=True).\
                  filter_by(handle=handle).\
                  first()
     if not result:
@@ -934,8 +1233,10 @@ def tfilter_delete_by_handle(context, handle):
 
 @require_context
 def tfilter_delete_by_instance(context, instanceid):
-    session = get_session()
-    session.execute('delete from tfilter where instanceid="'+instanceid+'"')
+    """Clear the filter handle of the rule of an instance."""
+    return _rowcount(_execute('rule_update_handle_by_instance',
+                              rule_instanceid=instanceid, new_handle=None,
+                              now=timeutils.utcnow()))
 
 
 @require_context
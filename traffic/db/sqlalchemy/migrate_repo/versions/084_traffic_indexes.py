@@ -0,0 +1,97 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import func, Index, MetaData, select, Table
+
+from traffic.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _indexes(tqdisc, tfilter, migrate_engine):
+    indexes = [
+        # a classid and a filter handle are unique per host
+        Index('uniq_tqdisc0host0classid', tqdisc.c.host, tqdisc.c.classid,
+              unique=True),
+        Index('uniq_tfilter0host0handle', tfilter.c.host, tfilter.c.handle,
+              unique=True),
+        Index('tqdisc_ip_idx', tqdisc.c.ip),
+        Index('tfilter_ip_idx', tfilter.c.ip),
+    ]
+    # NOTE: 082 already indexes instanceid on MySQL
+    if migrate_engine.name != 'mysql':
+        indexes.extend([
+            Index('tqdisc_instanceid_idx', tqdisc.c.instanceid),
+            Index('tfilter_instanceid_idx', tfilter.c.instanceid),
+        ])
+    return indexes
+
+
+def _cleanup(tqdisc, tfilter):
+    """Drop the rows that break the unique indexes without being live.
+
+    Soft deleted rows keep the classid and handle they had, which are
+    handed out again, and classids were once stored as '' instead of
+    NULL.  Live rows are left alone.
+    """
+    for table in (tqdisc, tfilter):
+        table.delete().where(table.c.deleted == True).execute()
+    tqdisc.update().where(tqdisc.c.classid == '').values(
+        classid=None).execute()
+
+
+def _log_duplicates(table, column):
+    duplicates = select([table.c.host, column, func.count()],
+                        column != None,
+                        group_by=[table.c.host, column],
+                        having=func.count() > 1).execute()
+    for host, value, count in duplicates:
+        LOG.error(_("%(count)d rows of %(table)s on host %(host)s have "
+                    "%(column)s %(value)s"),
+                  {'count': count, 'table': table.name, 'host': host,
+                   'column': column.name, 'value': value})
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    tqdisc = Table('tqdisc', meta, autoload=True)
+    tfilter = Table('tfilter', meta, autoload=True)
+
+    _cleanup(tqdisc, tfilter)
+
+    for index in _indexes(tqdisc, tfilter, migrate_engine):
+        try:
+            index.create(migrate_engine)
+        except Exception:
+            LOG.error(_("Index |%s| not created!"), index.name)
+            if index.unique:
+                _log_duplicates(index.table, list(index.columns)[1])
+            raise
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    tqdisc = Table('tqdisc', meta, autoload=True)
+    tfilter = Table('tfilter', meta, autoload=True)
+
+    for index in _indexes(tqdisc, tfilter, migrate_engine):
+        try:
+            index.drop(migrate_engine)
+        except Exception:
+            LOG.error(_("Index |%s| not dropped!"), index.name)
+            raise
@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import and_, Boolean, Column, DateTime, Index, Integer
+from sqlalchemy import MetaData, select, String, Table
+
+from traffic.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    tqdisc = Table('tqdisc', meta, autoload=True)
+    tfilter = Table('tfilter', meta, autoload=True)
+
+    traffic_rules = Table('traffic_rules', meta,
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('deleted_at', DateTime),
+        Column('deleted', Boolean),
+        Column('id', Integer, primary_key=True, nullable=False),
+        Column('instanceid', String(length=50)),
+        Column('host', String(length=100)),
+        Column('ip', String(length=25)),
+        Column('classid', String(length=20)),
+        Column('handle', Integer),
+        Column('prio', Integer),
+        Column('band', String(length=15)),
+        mysql_engine='InnoDB',)
+
+    try:
+        traffic_rules.create()
+    except Exception:
+        LOG.info(repr(traffic_rules))
+        LOG.exception('Exception while creating table.')
+        raise
+
+    indexes = [
+        Index('uniq_traffic_rules0host0classid', traffic_rules.c.host,
+              traffic_rules.c.classid, unique=True),
+        Index('uniq_traffic_rules0host0handle', traffic_rules.c.host,
+              traffic_rules.c.handle, unique=True),
+        Index('traffic_rules_instanceid_idx', traffic_rules.c.instanceid),
+        Index('traffic_rules_ip_idx', traffic_rules.c.ip),
+    ]
+    for index in indexes:
+        index.create(migrate_engine)
+
+    # one rule per tqdisc row, with the handle of its filter if it has one
+    rows = select([tqdisc.c.created_at, tqdisc.c.updated_at,
+                   tqdisc.c.instanceid, tqdisc.c.host, tqdisc.c.ip,
+                   tqdisc.c.classid, tfilter.c.handle, tqdisc.c.prio,
+                   tqdisc.c.band],
+                  from_obj=[tqdisc.outerjoin(
+                      tfilter,
+                      and_(tfilter.c.instanceid == tqdisc.c.instanceid,
+                           tfilter.c.host == tqdisc.c.host))],
+                  order_by=[tqdisc.c.id]).execute()
+    values = []
+    for row in rows:
+        values.append({'created_at': row[0],
+                       'updated_at': row[1],
+                       'deleted': False,
+                       'instanceid': row[2],
+                       'host': row[3],
+                       'ip': row[4],
+                       'classid': row[5],
+                       'handle': row[6],
+                       'prio': row[7],
+                       'band': row[8]})
+    if values:
+        migrate_engine.execute(traffic_rules.insert(), values)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    tqdisc = Table('tqdisc', meta, autoload=True)
+    tfilter = Table('tfilter', meta, autoload=True)
+    traffic_rules = Table('traffic_rules', meta, autoload=True)
+
+    # the tqdisc and tfilter rows are rebuilt from the rules, which are the
+    # only ones written since the upgrade
+    rules = traffic_rules.select().order_by(traffic_rules.c.id).execute()
+    tqdiscs = []
+    tfilters = []
+    for rule in rules:
+        tqdiscs.append({'created_at': rule['created_at'],
+                        'updated_at': rule['updated_at'],
+                        'deleted': False,
+                        'instanceid': rule['instanceid'],
+                        'host': rule['host'],
+                        'ip': rule['ip'],
+                        'classid': rule['classid'],
+                        'band': rule['band'],
+                        'prio': rule['prio']})
+        if rule['handle'] is not None:
+            tfilters.append({'created_at': rule['created_at'],
+                             'updated_at': rule['updated_at'],
+                             'deleted': False,
+                             'instanceid': rule['instanceid'],
+                             'host': rule['host'],
+                             'ip': rule['ip'],
+                             'classid': rule['classid'],
+                             'flowid': rule['classid'],
+                             'handle': rule['handle'],
+                             'prio': rule['prio']})
+
+    tfilter.delete().execute()
+    tqdisc.delete().execute()
+    if tqdiscs:
+        migrate_engine.execute(tqdisc.insert(), tqdiscs)
+    if tfilters:
+        migrate_engine.execute(tfilter.insert(), tfilters)
+    traffic_rules.drop()
@@ -139,11 +139,14 @@ class Service(BASE, TrafficBase):
 class Tqdisc(BASE, TrafficBase):
     '''tqdisc table of the service'''
     __tablename__ = 'tqdisc'
+    __table_args__ = (schema.UniqueConstraint("host", "classid",
+                                              name="uniq_tqdisc0host0classid"),
+                      {'mysql_engine': 'InnoDB'})
     id = Column(Integer, primary_key=True)
-    instanceid = Column(String(255))
+    instanceid = Column(String(255), index=True)
     classid = Column(String(22))
     host = Column(String(255))
-    ip = Column(String(23))
+    ip = Column(String(23), index=True)
     band = Column(String(22))
     prio = Column(Integer)
     
@@ -151,15 +154,42 @@ class Tfilter(BASE, TrafficBase):
     
     '''tfilter table of the service'''
     __tablename__ = 'tfilter'
+    __table_args__ = (schema.UniqueConstraint("host", "handle",
+                                              name="uniq_tfilter0host0handle"),
+                      {'mysql_engine': 'InnoDB'})
     id = Column(Integer, primary_key=True)
     classid = Column(String(50))
     host = Column(String(50))
     handle = Column(Integer)
-    ip = Column(String(255))
-    instanceid= Column(String(50))
+    ip = Column(String(255), index=True)
+    instanceid= Column(String(50), index=True)
     flowid = Column(String(255))
     prio = Column(Integer)
 
+class TrafficRule(BASE, TrafficBase):
+    '''Class and filter of the traffic of an instance on its host.
+
+    Supersedes the tqdisc and tfilter tables, which are only kept for the
+    downgrade of migration 085.  handle is None while the filter of the
+    rule is not set up.
+    '''
+    __tablename__ = 'traffic_rules'
+    __table_args__ = (schema.UniqueConstraint(
+                          "host", "classid",
+                          name="uniq_traffic_rules0host0classid"),
+                      schema.UniqueConstraint(
+                          "host", "handle",
+                          name="uniq_traffic_rules0host0handle"),
+                      {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, primary_key=True)
+    instanceid = Column(String(50), index=True)
+    host = Column(String(100))
+    ip = Column(String(25), index=True)
+    classid = Column(String(20))
+    handle = Column(Integer)
+    prio = Column(Integer)
+    band = Column(String(15))
+
 class ComputeNode(BASE, TrafficBase):
     """Represents a running compute service on a host."""
 
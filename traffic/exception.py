@@ -63,6 +63,16 @@ class ProcessExecutionError(IOError):
         IOError.__init__(self, message)
 
 
+class ProcessExecutionTimeout(ProcessExecutionError):
+    def __init__(self, timeout, stdout=None, stderr=None, exit_code=None,
+                 cmd=None):
+        self.timeout = timeout
+        description = _('Timed out after %ss') % timeout
+        super(ProcessExecutionTimeout, self).__init__(stdout, stderr,
+                                                      exit_code, cmd,
+                                                      description)
+
+
 def wrap_db_error(f):
     def _wrap(*args, **kwargs):
         try:
@@ -645,6 +655,10 @@ class FloatingIpNotFoundForHost(FloatingIpNotFound):
     message = _("Floating ip not found for host %(host)s.")
 
 
+class NoMoreClassIds(TrafficException):
+    message = _("Zero htb class ids available under %(major)s:.")
+
+
 class NoMoreFloatingIps(FloatingIpNotFound):
     message = _("Zero floating ips available.")
     safe = True
@@ -670,6 +684,9 @@ class NoTfilter(NotFound):
 class NoFloatingIpInterface(NotFound):
     message = _("Interface %(interface)s not found.")
 
+class NetInterfaceNotFound(NotFound):
+    message = _("Network interface %(interface)s not found on this host.")
+
 
 class KeypairNotFound(NotFound):
     message = _("Keypair %(name)s not found for user %(user_id)s")
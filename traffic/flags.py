@@ -74,6 +74,13 @@ def _get_my_ip():
 
 
 core_opts = [
+    cfg.StrOpt('pybasedir',
+               default=os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                    '../')),
+               help='Directory where the traffic python module is installed'),
+    cfg.StrOpt('state_path',
+               default='$pybasedir',
+               help="Top-level directory for maintaining traffic's state"),
     cfg.StrOpt('connection_type',
                default=None,
                help='Deprecated (use compute_driver instead): Virtualization '
@@ -82,6 +89,17 @@ core_opts = [
                default='sqlite:///$state_path/$sqlite_db',
                help='The SQLAlchemy connection string used to connect to the '
                     'database'),
+    cfg.StrOpt('slave_connection',
+               default=None,
+               help='The SQLAlchemy connection string of a read-only replica '
+                    'of the database.  The list, show and stats reads go to '
+                    'it when set'),
+    cfg.StrOpt('sqlite_db',
+               default='traffic.sqlite',
+               help='the filename to use with sqlite'),
+    cfg.BoolOpt('sqlite_synchronous',
+                default=True,
+                help='If passed, use synchronous mode for sqlite'),
     cfg.StrOpt('api_paste_config',
                default="api-paste.ini",
                help='File name for the paste.deploy config for traffic-api'),
@@ -112,6 +130,11 @@ global_opts = [
                default=None,
                help='Path to the rootwrap configuration file to use for '
                     'running commands as root'),
+    cfg.BoolOpt('use_rootwrap_daemon',
+                default=False,
+                help='Run the commands as root through a single '
+                     'traffic-rootwrap-daemon started with rootwrap_config, '
+                     'instead of one sudo traffic-rootwrap per command'),
     cfg.MultiStrOpt('osapi_compute_extension',
                     default=[
                       'traffic.api.openstack.compute.contrib.standard_extensions'
@@ -163,6 +186,13 @@ global_opts = [
                default='traffic.tfilter.api.API',
                help='The full class name of the tfilter API class to use'),
 
+    cfg.StrOpt('tc_driver',
+               default='traffic.compute.tcbatch.TcBatchDriver',
+               help='The full class name of the driver programming qdiscs, '
+                    'classes and filters: '
+                    'traffic.compute.tcbatch.TcBatchDriver or '
+                    'traffic.compute.netlink.NetlinkTcDriver'),
+
     cfg.StrOpt('auth_strategy',
                default='keystone',
                help='The strategy to use for auth: noauth or keystone.'),
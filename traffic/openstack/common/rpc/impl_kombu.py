@@ -192,7 +192,7 @@ class TopicConsumer(ConsumerBase):
     """Consumer class for 'topic'"""
 
     def __init__(self, conf, channel, topic, callback, tag, name=None,
-                 **kwargs):
+                 exchange_name=None, **kwargs):
         """Init a 'topic' queue.
 
         :param channel: the amqp channel to use
@@ -202,18 +202,22 @@ class TopicConsumer(ConsumerBase):
         :param tag: a unique ID for the consumer on the channel
         :param name: optional queue name, defaults to topic
         :paramtype name: str
+        :param exchange_name: optional exchange, defaults to control_exchange
+        :paramtype exchange_name: str
 
-        Other kombu options may be passed as keyword arguments
+        Other kombu options may be passed as keyword arguments, they apply
+        to the queue only
         """
         # Default options
         options = {'durable': conf.rabbit_durable_queues,
                    'auto_delete': False,
                    'exclusive': False}
         options.update(kwargs)
-        exchange = kombu.entity.Exchange(name=conf.control_exchange,
-                                         type='topic',
-                                         durable=options['durable'],
-                                         auto_delete=options['auto_delete'])
+        exchange = kombu.entity.Exchange(
+            name=exchange_name or conf.control_exchange,
+            type='topic',
+            durable=conf.rabbit_durable_queues,
+            auto_delete=False)
         super(TopicConsumer, self).__init__(channel,
                                             callback,
                                             tag,
@@ -625,11 +629,22 @@ class Connection(object):
         """
         self.declare_consumer(DirectConsumer, topic, callback)
 
-    def declare_topic_consumer(self, topic, callback=None, queue_name=None):
-        """Create a 'topic' consumer."""
+    def declare_topic_consumer(self, topic, callback=None, queue_name=None,
+                               exchange_name=None, exclusive=False):
+        """Create a 'topic' consumer.
+
+        An exclusive consumer gets a queue of its own, deleted with the
+        connection.
+        """
+        options = {}
+        if exclusive:
+            options = {'durable': False,
+                       'auto_delete': True,
+                       'exclusive': True}
         self.declare_consumer(functools.partial(TopicConsumer,
                                                 name=queue_name,
-                                                ),
+                                                exchange_name=exchange_name,
+                                                **options),
                               topic, callback)
 
     def declare_fanout_consumer(self, topic, callback):
@@ -170,7 +170,8 @@ class DirectConsumer(ConsumerBase):
 class TopicConsumer(ConsumerBase):
     """Consumer class for 'topic'"""
 
-    def __init__(self, conf, session, topic, callback, name=None):
+    def __init__(self, conf, session, topic, callback, name=None,
+                 exchange_name=None, exclusive=False):
         """Init a 'topic' queue.
 
         :param session: the amqp session to use
@@ -178,12 +179,15 @@ class TopicConsumer(ConsumerBase):
         :paramtype topic: str
         :param callback: the callback to call when messages are received
         :param name: optional queue name, defaults to topic
+        :param exchange_name: optional exchange, defaults to control_exchange
+        :param exclusive: whether the queue is for this session only
         """
 
+        exchange_name = exchange_name or conf.control_exchange
         super(TopicConsumer, self).__init__(session, callback,
-                                            "%s/%s" % (conf.control_exchange,
-                                                       topic),
-                                            {}, name or topic, {})
+                                            "%s/%s" % (exchange_name, topic),
+                                            {}, name or topic,
+                                            {"exclusive": exclusive})
 
 
 class FanoutConsumer(ConsumerBase):
@@ -464,11 +468,17 @@ class Connection(object):
         """
         self.declare_consumer(DirectConsumer, topic, callback)
 
-    def declare_topic_consumer(self, topic, callback=None, queue_name=None):
-        """Create a 'topic' consumer."""
+    def declare_topic_consumer(self, topic, callback=None, queue_name=None,
+                               exchange_name=None, exclusive=False):
+        """Create a 'topic' consumer.
+
+        An exclusive consumer gets a queue of its own, deleted with the
+        session.
+        """
         self.declare_consumer(functools.partial(TopicConsumer,
                                                 name=queue_name,
-                                                ),
+                                                exchange_name=exchange_name,
+                                                exclusive=exclusive),
                               topic, callback)
 
     def declare_fanout_consumer(self, topic, callback):
@@ -0,0 +1,133 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client of the rootwrap daemon, see :mod:`traffic.rootwrap.daemon`.
+
+The daemon is started on the first privileged command and again after it
+exits.  Any number of green threads may run commands at once: requests are
+written under a lock and one reader green thread hands every response to
+the thread waiting for it.
+"""
+
+from eventlet import event
+from eventlet import greenthread
+from eventlet.green import socket
+from eventlet.green import subprocess
+from eventlet import semaphore
+
+from traffic import exception
+from traffic import flags
+from traffic.openstack.common import log as logging
+from traffic.rootwrap import daemon
+
+
+LOG = logging.getLogger(__name__)
+
+FLAGS = flags.FLAGS
+
+
+class Client(object):
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self._sock = None
+        self._process = None
+        # request id -> event of the requests sent to the running daemon
+        self._pending = {}
+        self._next_id = 0
+        self._lock = semaphore.Semaphore()
+
+    def _start(self):
+        LOG.info(_('Starting the rootwrap daemon: %s'), ' '.join(self.cmd))
+        sock, child = socket.socketpair()
+        try:
+            self._process = subprocess.Popen(self.cmd,
+                                             stdin=child.fileno(),
+                                             stdout=child.fileno(),
+                                             close_fds=True)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            child.close()
+        self._sock = sock
+        self._pending = {}
+        greenthread.spawn_n(self._read, sock, self._process, self._pending)
+
+    def _read(self, sock, process, pending):
+        try:
+            while True:
+                response = daemon.recv_message(sock)
+                if response is None:
+                    break
+                waiter = pending.pop(response['id'], None)
+                if waiter is not None:
+                    waiter.send(response)
+        except Exception:
+            LOG.exception(_('Lost the rootwrap daemon'))
+        if self._sock is sock:
+            self._sock = None
+        sock.close()
+        code = process.wait()
+        LOG.warn(_('The rootwrap daemon exited with %s'), code)
+        for waiter in pending.values():
+            waiter.send_exception(exception.TrafficException(
+                _('The rootwrap daemon exited with %s') % code))
+        pending.clear()
+
+    def execute(self, cmd, process_input=None, timeout=None):
+        """Run cmd as root, returns (exit code, stdout, stderr).
+
+        Raises exception.ProcessExecutionTimeout if the daemon killed cmd
+        after timeout seconds.
+        """
+        waiter = event.Event()
+        with self._lock:
+            if self._sock is None:
+                self._start()
+            self._next_id += 1
+            request = {'id': self._next_id,
+                       'cmd': list(cmd),
+                       'input': None,
+                       'timeout': timeout}
+            if process_input is not None:
+                request['input'] = process_input.decode('latin-1')
+            self._pending[request['id']] = waiter
+            try:
+                daemon.send_message(self._sock, request)
+            except socket.error:
+                self._pending.pop(request['id'], None)
+                raise exception.TrafficException(
+                    _('Cannot reach the rootwrap daemon'))
+        response = waiter.wait()
+        code = response['code']
+        stdout = response['stdout'].encode('latin-1')
+        stderr = response['stderr'].encode('latin-1')
+        if response.get('timed_out'):
+            raise exception.ProcessExecutionTimeout(
+                timeout, stdout=stdout, stderr=stderr, exit_code=code,
+                cmd=' '.join(cmd))
+        return code, stdout, stderr
+
+
+_CLIENT = None
+
+
+def get_client():
+    """Return the client of the rootwrap daemon of this process."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = Client(['sudo', 'traffic-rootwrap-daemon',
+                          FLAGS.rootwrap_config])
+    return _CLIENT
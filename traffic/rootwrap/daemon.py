@@ -0,0 +1,211 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long running root wrapper serving commands over a unix socket.
+
+The daemon is started once per agent, as
+``sudo traffic-rootwrap-daemon <config>``, with one end of a unix socket
+pair as its stdin and stdout (see :mod:`traffic.rootwrap.client`), so only
+the agent that started it can talk to it.  The filters of the config are
+loaded once; every request is checked against them exactly as
+traffic-rootwrap does, run, and answered with its exit code, stdout and
+stderr.  Requests are served concurrently and the daemon exits as soon as
+the agent closes its end of the socket.
+
+Messages are a 4 byte big-endian length followed by a JSON object,
+{"id", "cmd", "input", "timeout"} for requests and {"id", "code", "stdout",
+"stderr", "timed_out"} for responses; a command still running after its
+timeout, if any, is killed.  Byte strings travel as latin-1 so that any
+output comes back unchanged.
+"""
+
+import ConfigParser
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+
+from traffic.rootwrap import wrapper
+
+
+# exit codes of traffic-rootwrap
+RC_UNAUTHORIZED = 99
+RC_NOCOMMAND = 98
+RC_BADCONFIG = 97
+RC_NOEXECFOUND = 96
+
+_HEADER = struct.Struct('!I')
+MAX_MESSAGE = 64 * 1024 * 1024
+
+
+def send_message(sock, message):
+    data = json.dumps(message)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def recv_message(sock):
+    """Return the next message of sock, or None once it is closed."""
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    size, = _HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ValueError('Message of %d bytes is too large' % size)
+    data = _recv_exactly(sock, size)
+    if data is None:
+        return None
+    return json.loads(data)
+
+
+def load_filters(config_file):
+    """Load the filters of the filters_path of a rootwrap config file.
+
+    The filters are indexed by command, as every request is matched
+    against them.
+    """
+    config = ConfigParser.RawConfigParser()
+    if not config.read(config_file):
+        raise IOError('Cannot read %s' % config_file)
+    filters_path = config.get('DEFAULT', 'filters_path').split(',')
+    return wrapper.FilterIndex(
+        wrapper.load_filters([path.strip() for path in filters_path]))
+
+
+def _subprocess_setup():
+    # Python installs a SIGPIPE handler by default. This is usually not what
+    # non-Python subprocesses expect.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def _kill(obj, timed_out):
+    timed_out.append(True)
+    try:
+        obj.kill()
+    except OSError:
+        # it exited in the meantime
+        pass
+
+
+def run_command(filters, userargs, process_input=None, timeout=None):
+    """Run userargs if one of filters allows it.
+
+    Returns (exit code, stdout, stderr, timed out), with the
+    traffic-rootwrap exit codes for commands that are not run.
+    """
+    if not userargs:
+        return RC_NOCOMMAND, '', 'No command specified\n', False
+    filtermatch = wrapper.match_filter(filters, userargs)
+    if filtermatch is None:
+        return (RC_UNAUTHORIZED, '',
+                'Unauthorized command: %s\n' % ' '.join(userargs), False)
+    command = filtermatch.get_command(userargs)
+    try:
+        obj = subprocess.Popen(command,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               preexec_fn=_subprocess_setup,
+                               env=filtermatch.get_environment(userargs))
+    except OSError, e:
+        return (RC_NOEXECFOUND, '',
+                'Executable not found: %s (%s)\n' % (filtermatch.exec_path,
+                                                     e), False)
+    timed_out = []
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, _kill, args=(obj, timed_out))
+        timer.start()
+    try:
+        out, err = obj.communicate(process_input)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    return obj.returncode, out, err, bool(timed_out)
+
+
+class Server(object):
+    """Serve the requests of the agent connected to sock."""
+
+    def __init__(self, sock, filters):
+        self.sock = sock
+        self.filters = filters
+        self._send_lock = threading.Lock()
+
+    def _handle(self, request):
+        userargs = [arg.encode('utf-8') for arg in request['cmd']]
+        process_input = request.get('input')
+        if process_input is not None:
+            process_input = process_input.encode('latin-1')
+        try:
+            code, out, err, timed_out = run_command(
+                self.filters, userargs, process_input,
+                request.get('timeout'))
+        except Exception, e:
+            code, out, err, timed_out = RC_NOEXECFOUND, '', '%s\n' % e, False
+        response = {'id': request['id'],
+                    'code': code,
+                    'stdout': out.decode('latin-1'),
+                    'stderr': err.decode('latin-1'),
+                    'timed_out': timed_out}
+        with self._send_lock:
+            send_message(self.sock, response)
+
+    def serve(self):
+        while True:
+            request = recv_message(self.sock)
+            if request is None:
+                return
+            thread = threading.Thread(target=self._handle, args=(request,))
+            thread.daemon = True
+            thread.start()
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.stderr.write('Usage: %s <rootwrap config>\n' % sys.argv[0])
+        sys.exit(RC_BADCONFIG)
+    try:
+        filters = load_filters(sys.argv[1])
+    except (ConfigParser.Error, IOError), e:
+        sys.stderr.write('Bad rootwrap config %s: %s\n' % (sys.argv[1], e))
+        sys.exit(RC_BADCONFIG)
+
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    # the agent end is a green, non-blocking socket sharing its flags
+    sock.setblocking(1)
+    # stdin and stdout are the socket, nothing else may write to them
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    try:
+        Server(sock, filters).serve()
+    except (KeyboardInterrupt, socket.error):
+        pass
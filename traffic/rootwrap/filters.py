@@ -26,10 +26,19 @@ class CommandFilter(object):
         self.exec_path = exec_path
         self.run_as = run_as
         self.args = args
+        self.name = os.path.basename(exec_path)
+
+    def command_name(self):
+        """Return the only first argument this filter can match.
+
+        None means any command may match, the filter is then tried for
+        every command.
+        """
+        return self.name
 
     def match(self, userargs):
         """Only check that the first argument (command) matches exec_path"""
-        if (os.path.basename(self.exec_path) == userargs[0]):
+        if (self.name == userargs[0]):
             return True
         return False
 
@@ -48,30 +57,41 @@ class CommandFilter(object):
 class RegExpFilter(CommandFilter):
     """Command filter doing regexp matching for every argument"""
 
+    def __init__(self, exec_path, run_as, *args):
+        super(RegExpFilter, self).__init__(exec_path, run_as, *args)
+        # patterns are compiled once, anchored explicitly at end of string
+        try:
+            self.regexps = tuple(re.compile(pattern + '$')
+                                 for pattern in args)
+        except re.error:
+            # Badly-formed filter, it denies everything
+            self.regexps = None
+
+    def command_name(self):
+        if self.args and re.escape(self.args[0]) == self.args[0]:
+            return self.args[0]
+        return None
+
     def match(self, userargs):
+        regexps = self.regexps
         # Early skip if command or number of args don't match
-        if (len(self.args) != len(userargs)):
-            # DENY: argument numbers don't match
+        if regexps is None or len(regexps) != len(userargs):
+            # DENY: badly-formed filter or argument numbers don't match
             return False
-        # Compare each arg (anchoring pattern explicitly at end of string)
-        for (pattern, arg) in zip(self.args, userargs):
-            try:
-                if not re.match(pattern + '$', arg):
-                    break
-            except re.error:
-                # DENY: Badly-formed filter
+        for index in xrange(len(regexps)):
+            if regexps[index].match(userargs[index]) is None:
+                # DENY: Some arguments did not match
                 return False
-        else:
-            # ALLOW: All arguments matched
-            return True
-
-        # DENY: Some arguments did not match
-        return False
+        # ALLOW: All arguments matched
+        return True
 
 
 class DnsmasqFilter(CommandFilter):
     """Specific filter for the dnsmasq call (which includes env)"""
 
+    def command_name(self):
+        return None
+
     def match(self, userargs):
         if (userargs[0].startswith("FLAGFILE=") and
             userargs[1].startswith("NETWORK_ID=") and
@@ -102,6 +122,9 @@ class KillFilter(CommandFilter):
     def __init__(self, *args):
         super(KillFilter, self).__init__("/bin/kill", *args)
 
+    def command_name(self):
+        return "kill"
+
     def match(self, userargs):
         if userargs[0] != "kill":
             return False
@@ -141,6 +164,9 @@ class ReadFileFilter(CommandFilter):
         self.file_path = file_path
         super(ReadFileFilter, self).__init__("/bin/cat", "root", *args)
 
+    def command_name(self):
+        return "cat"
+
     def match(self, userargs):
         if userargs[0] != 'cat':
             return False
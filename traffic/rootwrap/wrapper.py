@@ -50,14 +50,55 @@ def load_filters(filters_path):
     return filterlist
 
 
+class FilterIndex(object):
+    """Filters indexed by the command they can match.
+
+    Every command maps to its own filters and the ones that may match any
+    command, in the order they were loaded, so that matching a command
+    only tries the filters that can allow it.
+    """
+
+    def __init__(self, filterlist):
+        self.filters = list(filterlist)
+        self.any_command = []
+        self.by_command = {}
+        for f in self.filters:
+            name = f.command_name()
+            if name is None:
+                self.any_command.append(f)
+                for candidates in self.by_command.itervalues():
+                    candidates.append(f)
+            else:
+                candidates = self.by_command.get(name)
+                if candidates is None:
+                    candidates = self.by_command[name] = list(
+                        self.any_command)
+                candidates.append(f)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def __iter__(self):
+        return iter(self.filters)
+
+    def candidates(self, userargs):
+        """Returns the filters that may match userargs, in load order."""
+        return self.by_command.get(userargs[0], self.any_command)
+
+
 def match_filter(filters, userargs):
     """
     Checks user command and arguments through command filters and
     returns the first matching filter, or None is none matched.
+
+    filters is a list of filters or a FilterIndex.
     """
 
     found_filter = None
 
+    if isinstance(filters, FilterIndex):
+        filters = filters.candidates(userargs)
+
     for f in filters:
         if f.match(userargs):
             # Try other filters if executable is absent
@@ -72,7 +72,7 @@ def _compute_topic(topic, ctxt, host, instance):
 class SchedulerManager(manager.Manager):
     """Chooses a host to run instances on."""
 
-    RPC_API_VERSION = '2.2'
+    RPC_API_VERSION = '2.3'
 
     def __init__(self, scheduler_driver=None, *args, **kwargs):
         '''if not scheduler_driver:
@@ -106,6 +106,10 @@ class SchedulerManager(manager.Manager):
                 instance_id=instance_id,
                 band=band, host=host, mac=mac, prio=prio)
     
+    def update_traffic(self, context, instance_id, band, host, prio=None):
+        self.compute_rpcapi.update_traffic(context, instance_id=instance_id,
+                band=band, prio=prio, host=host)
+
     def delete_traffic(self, context, instance_id, host, mac):
         self.compute_rpcapi.delete_traffic(context, instance_id=instance_id,
                         host=host, mac=mac)
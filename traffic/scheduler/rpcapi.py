@@ -46,6 +46,7 @@ class SchedulerAPI(traffic.openstack.common.rpc.proxy.RpcProxy):
         2.0 - Remove 1.x backwards compat
         2.1 - Add image_id to create_volume()
         2.2 - Remove reservations argument to create_volume()
+        2.3 - Adds update_traffic()
     '''
 
     #
@@ -77,6 +78,11 @@ class SchedulerAPI(traffic.openstack.common.rpc.proxy.RpcProxy):
         return self.cast(ctxt, self.make_msg('create_traffic',
                     ip=ip, instance_id=instance_id, band=band, host=host, mac=mac, prio=prio))    
         
+    def update_traffic(self, ctxt, instance_id, band, prio, host):
+        return self.cast(ctxt, self.make_msg('update_traffic',
+                instance_id=instance_id, band=band, prio=prio, host=host),
+                version='2.3')
+
     def delete_traffic(self, ctxt, instance_id, host, mac):
         return self.cast(ctxt, self.make_msg('delete_traffic',
                     instance_id=instance_id, host=host, mac=mac))    
@@ -2,58 +2,216 @@
 from traffic import rootwrap
 from traffic import utils
 from traffic import db
+from traffic import exception
 from traffic import flags
+from traffic.compute import tcbatch
 from traffic.db import base
 from traffic.openstack.common import cfg
+from traffic.tqdisc import parser
 import os
+import socket
+import struct
 
 traffic_opts = [
     cfg.StrOpt('interface',
                default='eth0',
                help="the interface of the vm"),
+    cfg.StrOpt('tc_filter_match',
+               default='src',
+               help='Address the instance filters match on: src or dst'),
     ]
 
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(traffic_opts)
 
+# offsets of the source and destination address in the ip header
+MATCH_OFFSETS = {'src': 12, 'dst': 16}
+
+# the instance filters are spread over one u32 hash table per /24, linked
+# from the root table 800: and hashed on the last octet of the address
+HASH_DIVISOR = 256
+MAX_HTID = 0x7ff
+
+# u32 prio of the instance filters; the prio of a traffic rule is the one of
+# its htb class
+FILTER_PRIO = 1
+
+ROOT_HTID = 0x800
+
+
+def link_subnet(record):
+    """Return the /24 a link filter record matches, e.g. '10.0.1', or None."""
+    for value, mask, _offset in record.keys:
+        if mask == 0xffffff00:
+            network = socket.inet_ntoa(struct.pack('!I', value))
+            return network.rpartition('.')[0]
+    return None
+
+
+def parse_hash_tables(records):
+    """Collect the subnet tables from parsed 'tc filter show' records.
+
+    Returns a dict of prio to ({subnet: htid}, set of htids in use), where
+    subnet is the first three octets of the /24, e.g. '10.0.1'.
+    """
+    tables = {}
+    for record in records:
+        if record.divisor:
+            htid = record.handle >> 20
+        elif record.link and record.handle >> 20 == ROOT_HTID:
+            htid = record.link >> 20
+        else:
+            continue
+        subnets, used = tables.setdefault(record.prio, ({}, set()))
+        used.add(htid)
+        subnet = link_subnet(record)
+        if subnet is not None:
+            subnets[subnet] = htid
+    return tables
+
+
+def u32_handle(value):
+    """Render the integer handle stored in traffic rules for tc."""
+    if value < (1 << 20):
+        # filters of the old linear chain, numbered from 800
+        return '800::' + str(value)
+    return parser.format_u32_handle(value)
+
+
 class API(base.Base):
-    
+
+    def __init__(self, *args, **kwargs):
+        super(API, self).__init__(*args, **kwargs)
+        # (interface, prio) -> ({subnet: htid}, htids in use)
+        self._tables = {}
+        # held while the tables of an interface are read from tc
+        self._locks = utils.KeyedLock()
+
     def set_execute(self, execute):        
         self._execute = execute
         
-    def create(self, context, ip, class_id, instanceid, host, prio=1):
+    def lock(self, interface):
+        """Lock the subnet tables of interface while reading them from tc."""
+        return self._locks.lock(interface)
+
+    def _hash_tables(self, interface, prio):
+        """Return the subnet tables of a filter prio, read once from tc."""
+        if (interface, prio) not in self._tables:
+            with self.lock(interface):
+                if (interface, prio) not in self._tables:
+                    self.load_tables(interface,
+                                     parser.show_filters(interface))
+                    self._tables.setdefault((interface, prio),
+                                            ({}, set()))
+        return self._tables[(interface, prio)]
+
+    def subnet_tables(self, interface, prio):
+        """Return {subnet: htid} of the tables known for a filter prio."""
+        return dict(self._hash_tables(interface, prio)[0])
+
+    def queue_hashtable(self, interface, prio, htid, tc, tag=None):
+        """Queue the u32 hash table htid."""
+        tc.add_hashtable(interface, '10:', prio, '%x:' % htid,
+                         divisor=HASH_DIVISOR, tag=tag)
+
+    def queue_link(self, interface, prio, subnet, htid, tc, tag=None):
+        """Queue the filter of the root table sending a /24 to htid."""
+        field = FLAGS.tc_filter_match
+        tc.add_filter(interface, '10:', prio,
+                      match=[(field, subnet + '.0/24')],
+                      handle='800::%x' % htid, ht='800:',
+                      link='%x:' % htid,
+                      hashkey=(0xff, MATCH_OFFSETS[field]), tag=tag)
+
+    def _subnet_table(self, interface, prio, subnet, tc, tag):
+        """Return the htid of the table of a /24, queueing it if new."""
+        subnets, used = self._hash_tables(interface, prio)
+        htid = subnets.get(subnet)
+        if htid is not None:
+            return htid
+        free = [i for i in xrange(1, MAX_HTID + 1) if i not in used]
+        if not free:
+            raise exception.TrafficException(
+                _('No free u32 hash table on %s') % interface)
+        htid = free[0]
+        self.queue_hashtable(interface, prio, htid, tc, tag)
+        self.queue_link(interface, prio, subnet, htid, tc, tag)
+        subnets[subnet] = htid
+        used.add(htid)
+        return htid
+
+    def load_tables(self, interface, records):
+        """Merge the subnet tables found in tc into the cache of interface.
+
+        records are the parsed filters of interface, see
+        :func:`traffic.tqdisc.parser.parse_filters`, read under
+        :meth:`lock`.  The tables of tc win; the ones only cached are kept,
+        they may still be queued in a batch that is not applied yet.
+        """
+        for prio, (subnets, used) in parse_hash_tables(records).iteritems():
+            cached = self._tables.get((interface, prio))
+            if cached is None:
+                self._tables[(interface, prio)] = (subnets, used)
+            else:
+                cached[0].update(subnets)
+                cached[1].update(used)
+
+    def queue_filter(self, interface, ip, class_id, prio, tc, tag=None):
+        """Queue the filter of an address in its subnet table.
+
+        Returns the integer u32 handle of the filter.
+        """
+        subnet, _sep, octet = ip.rpartition('.')
+        htid = self._subnet_table(interface, prio, subnet, tc, tag)
+        bucket = int(octet) % HASH_DIVISOR
+        handle = (htid << 20) | (bucket << 12) | 1
+        tc.add_filter(interface, '10:', prio,
+                      match=[(FLAGS.tc_filter_match, ip + '/32')],
+                      flowid=class_id, handle=u32_handle(handle),
+                      ht='%x:%x:' % (htid, bucket), tag=tag)
+        return handle
+
+    def create(self, context, ip, class_id, instanceid, host,
+               prio=FILTER_PRIO, batch=None, rule=None):
+        """Queue the filter of an instance and record it in its rule.
+
+        With rule, the handle is only set in that dict, which the caller
+        writes with db.traffic_rule_create; otherwise the existing rule of
+        the instance is updated.
+        """
         interface = FLAGS.interface
-        ips = ip + '/32'
-        cmd = ['tc filter add dev ', interface, ' parent 10: protocol ip prio ', prio ,' u32 match ip src ', ips, ' flowid ', class_id]
-        cmd = map(str, cmd)
-        #self._execute(cmd)
-        
-        handle = self.db.tfilter_get_last_handle(context, host)
-        if not handle:
-            handle = 799
+        tc = batch or tcbatch.TcBatch()
+        handle = self.queue_filter(interface, ip, class_id, prio, tc,
+                                   tag=('tfilter', instanceid))
+        if rule is None:
+            self.db.tfilter_create(context, {'instanceid': instanceid,
+                                             'handle': handle})
         else:
-            handle = handle[0]
-        self.db.tfilter_create(context, 
-                               {'ip': ip, 
-                                'classid': class_id,
-                                'flowid': class_id, 
-                                'instanceid': instanceid,
-                                'handle': handle+1, 
-                                'host': host,
-                                'prio': prio})
-        
-        os.system(''.join(cmd))
-        
-    def delete(self, context, instanceid):       
-        tfilter = self.db.tfilter_get_by_instance(context, instanceid)
+            rule['handle'] = handle
+        if batch is None:
+            tcbatch.log_failures(tc.flush())
+        return handle
+
+    def delete(self, context, instanceid, batch=None, rule=None):
+        """Queue the removal of the filter of an instance.
+
+        With rule, the caller has already deleted it from the database.
+        """
+        if rule is None:
+            rule = self.db.tfilter_get_by_instance(context, instanceid)
+            if rule is None:
+                raise exception.NoTfilter(tfilter=instanceid)
+            self.db.tfilter_delete_by_instance(context, instanceid)
+        if rule['handle'] is None:
+            return
         interface = FLAGS.interface
-        handle_r = '800::' + str(tfilter[8])
-        cmd = ['tc filter del dev ', interface, ' parent 10: prio ', tfilter[11], ' handle ', handle_r, ' u32']
-        cmd = map(str, cmd)
-        os.system(''.join(cmd))
-#        self._execute(cmd)
-        self.db.tfilter_delete_by_instance(context, instanceid)
+        tc = batch or tcbatch.TcBatch()
+        tc.del_filter(interface, '10:', FILTER_PRIO,
+                      u32_handle(rule['handle']),
+                      tag=('tfilter', instanceid))
+        if batch is None:
+            tcbatch.log_failures(tc.flush())
     
     def get(self, context, class_id):
         result = self.db.tfilter_get_by_classid(context, class_id)
@@ -3,9 +3,13 @@ from traffic import flags
 from traffic.openstack.common import cfg
 from traffic import utils
 from traffic import rootwrap
+from traffic.compute import classids
+from traffic.compute import executor
+from traffic.compute import tcbatch
 from traffic.db import base
+from traffic import exception
 from traffic import flags
-import os
+from traffic.tqdisc import parser
 
 traffic_opts = [
     cfg.StrOpt('interface',
@@ -18,93 +22,122 @@ FLAGS = flags.FLAGS
 FLAGS.register_opts(traffic_opts)
 
 class API(base.Base):
-    
+
+    def __init__(self, *args, **kwargs):
+        super(API, self).__init__(*args, **kwargs)
+        self._execute = executor.get_executor().execute
+        # interfaces whose htb root is known to be set up
+        self._root_ready = set()
+
     def set_execute(self, execute):
         self._execute = execute
         
-    def create_won(self, context, instance_id, band, host, mac, ip, prio=1):
-        mac = mac[3:]
-        cmdlist = ["ifconfig | grep ", mac, " | awk \'{print $1}\'"]
-        eht = os.popen("".join(cmdlist))
-        virnt = eht.read().rstrip()
-        cmds = ['tc qdisc add dev ', virnt, ' handle ffff: ingress']
-        cmdfil = ['tc filter add dev ', virnt, ' parent ffff: protocol ip prio 50 u32 match ip src 0.0.0.0/0 police rate ']
-        cmdfil.append(band)
-        cmdfil.append('Mbit burst 10k drop flowid :1')
-        self.db.tqdisc_create(context,
-                              {'instanceid': instance_id,
-                               'classid': '',
-                               'prio': prio, 
-                               'host': host,
-                               'ip': ip,
-                               'band': band+'Mbits'})
-        os.system(''.join(cmds))
-        os.system(''.join(cmdfil))
-        
-    def create(self, context, instance_id, band, host, ip, mac, prio=1):
-        etg = os.popen("tc qdisc list | grep 'qdisc htb 10: dev br100 root'")
-        pclass = etg.read()
+    def _ensure_root(self, interface, batch):
+        """Queue the htb root qdisc and class unless they already exist."""
+        if interface in self._root_ready:
+            return
+        out, _err = self._execute('tc', 'qdisc', 'show', 'dev', interface,
+                                  run_as_root=True)
+        if 'qdisc htb 10:' not in out:
+            self.add_root(interface, batch)
+        self._root_ready.add(interface)
+
+    def add_root(self, interface, batch):
+        """Queue the htb root qdisc and the parent class of instances."""
+        batch.add_qdisc(interface, '10:', 'htb', default=10)
+        batch.add_class(interface, '10:', '10:1', '1000Mbit',
+                        ceil='1000Mbit')
+
+    def create(self, context, instance_id, band, host, ip, mac, prio=1,
+               batch=None, rule=None):
+        """Queue the class of an instance and record it in its rule.
+
+        With rule, the values are only added to that dict, for the caller
+        to write the whole rule with db.traffic_rule_create once the filter
+        is queued too; otherwise a rule without filter is created.
+        """
         interface = FLAGS.interface
+        tc = batch or tcbatch.TcBatch()
+        self._ensure_root(interface, tc)
 
-        if not pclass:
-            os.system('tc qdisc add dev ', interface, ' root handle 10: htb default 10')
-            os.system('tc class add dev br100 parent 10: classid 10:1 htb rate 1000Mbit ceil 1000Mbit')
-        classid = self.db.get_classid(context)
-        if not classid:
-            classid = '10:10'
-#            cmds = ['tc class add dev eth0 parent 10:1 classid ', classid, ' htb rate ', band, 'Mbits prio ', str(prio)]
-#            os.system(''.join(cmds))
-        else: 
-            classid = classid[0]
-        new_id = int(classid.split(':')[1]) + 1
-        new_class_id = '10:' + str(new_id)
-        bands = band + 'Mbit'
-        cmd = ['tc class add dev br100 parent 10:1 classid ', new_class_id, ' htb rate ', bands, ' prio ', str(prio)]
-        self.db.tqdisc_create(context,
-                              {'instanceid': instance_id,
-                               'classid': new_class_id,
-                               'prio': prio, 
-                               'host': host,
-                               'ip': ip,
-                               'band': bands})
-#        self._execute('tc class add dev eth0 parent 10:1 classid', new_class_id, 'htb rate', bands, 'prio', prio)
-        os.system(''.join(cmd))
+        new_class_id = classids.get_pool().allocate(context, interface)
+        bands = parser.format_band(band)
+        tc.add_class(interface, '10:1', new_class_id, bands, prio=prio,
+                     tag=('tqdisc', instance_id))
+        values = {'instanceid': instance_id,
+                  'classid': new_class_id,
+                  'prio': prio,
+                  'host': host,
+                  'ip': ip,
+                  'band': bands}
+        if rule is None:
+            self.db.traffic_rule_create(context, values)
+        else:
+            rule.update(values)
+        if batch is None:
+            tcbatch.log_failures(tc.flush())
         return new_class_id
         
+    def update(self, context, instance_id, band, prio=None, batch=None):
+        """Change the rate and prio of the class of an instance in place.
+
+        The class keeps its classid, so its filter stays untouched and the
+        instance is shaped at any time.  Without prio the class keeps the
+        prio of its rule: tc class change resets any prio it is not given.
+        """
+        rule = self.db.traffic_rule_get_by_instance(context, instance_id)
+        if rule is None or not rule['classid']:
+            raise exception.NoTqdisc(tqdisc=instance_id)
+        if prio is None:
+            prio = rule['prio']
+        interface = FLAGS.interface
+        tc = batch or tcbatch.TcBatch()
+        bands = parser.format_band(band)
+        tc.change_class(interface, '10:1', rule['classid'], bands, prio=prio,
+                        tag=('tqdisc', instance_id))
+        self.db.tqdisc_update_by_instanceid(context, instance_id, bands, prio)
+        if batch is None:
+            tcbatch.log_failures(tc.flush())
+        return rule['classid']
+
     def get(self, context, id):
-        result = self.db.tqdisc_get(context, id)
+        result = self.db.tqdisc_get(context, id, use_slave=True)
         return result
     
-    def get_all(self, context):
-        result = self.db.tqdisc_get_all(context)
-        return result
+    def get_all(self, context, filters=None, limit=None, marker=None):
+        if filters is None and limit is None and marker is None:
+            return self.db.tqdisc_get_all(context, use_slave=True)
+        return self.db.tqdisc_get_all_by_filters(context, filters, limit,
+                                                 marker, use_slave=True)
     
+    def get_all_iter(self, context, filters=None):
+        return self.db.tqdisc_get_all_iter(context, filters, use_slave=True)
+
     def get_by_instance_id(self, context, instance_id):
-        result = self.db.tqdisc_get_by_instance_id(context, instance_id)
+        result = self.db.tqdisc_get_by_instance_id(context, instance_id,
+                                                   use_slave=True)
         return result
     
     def get_host(self, context, classid):
         return self.db.tqdisc_get_host(context, classid)
     
     def get_by_ip(self, context, ip):
-        result = self.db.tqdisc_get_by_ip(context, ip)
+        result = self.db.tqdisc_get_by_ip(context, ip, use_slave=True)
         return result
     
-    def delete_bk(self, context, instance_id, mac):
-        mac = mac[3:]
-        cmdlist = ["ifconfig | grep ", mac, " | awk \'{print $1}\'"]
-        eht = os.popen("".join(cmdlist))
-        virnt = eht.read().rstrip()
-        cmd = ['tc qdisc del dev ', virnt, ' root']
-        cmds = ['tc qdisc del dev ', virnt, ' ingress']
-        self.db.tqdisc_delete_by_instanceid(context, instance_id)
-        os.system(''.join(cmd))
-        os.system(''.join(cmds))
-        
-    def delete(self, context, instanceid):
-        classid = self.db.get_classid_by_instance(context, instanceid)
+    def delete(self, context, instanceid, batch=None, rule=None):
+        """Queue the removal of the class of an instance.
+
+        With rule, the caller has already deleted it from the database.
+        """
+        if rule is None:
+            rule = self.db.traffic_rule_get_by_instance(context, instanceid)
+            if rule is None:
+                raise exception.NoTqdisc(tqdisc=instanceid)
+            self.db.tqdisc_delete_by_instanceid(context, instanceid)
         interface = FLAGS.interface
-        cmd = ['tc class del dev ', interface, ' classid ', classid[0]]
-        os.system(''.join(cmd))
-        #self._execute(cmd)
-        self.db.tqdisc_delete_by_instanceid(context, instanceid)
\ No newline at end of file
+        tc = batch or tcbatch.TcBatch()
+        tc.del_class(interface, rule['classid'], tag=('tqdisc', instanceid))
+        classids.get_pool().free(context, interface, rule['classid'])
+        if batch is None:
+            tcbatch.log_failures(tc.flush())
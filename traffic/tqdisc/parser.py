@@ -0,0 +1,201 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Streaming parser for the output of ``tc [-s] [-d] class|filter show``.
+
+The parsers take any iterable of lines, typically the output of
+:meth:`traffic.compute.executor.CommandExecutor.execute_lines`, and yield
+one record per class or filter as soon as it is complete, so a dump of
+thousands of classes is never held in memory as a whole.
+"""
+
+import socket
+import struct
+
+from traffic.compute import executor
+from traffic.compute import netlink
+
+
+_RATE_UNITS = {'bit': 1, 'Kbit': 1000, 'Mbit': 1000 ** 2,
+               'Gbit': 1000 ** 3, 'Tbit': 1000 ** 4}
+
+
+def parse_rate(rate):
+    """Convert a rate as printed by tc ('5Mbit', '500Kbit') to bit/s."""
+    for suffix in ('Kbit', 'Mbit', 'Gbit', 'Tbit', 'bit'):
+        if rate.endswith(suffix):
+            return int(float(rate[:-len(suffix)]) * _RATE_UNITS[suffix])
+    return int(float(rate))
+
+
+def format_band(band):
+    """Render a band in Mbit/s as the tc rate traffic rules store."""
+    return '%sMbit' % band
+
+
+def parse_band(rate):
+    """Return the band in Mbit/s of a rate stored in a traffic rule."""
+    return '%g' % (parse_rate(rate) / float(_RATE_UNITS['Mbit']))
+
+
+def format_u32_handle(handle):
+    return '%x:%x:%x' % (handle >> 20, (handle >> 12) & 0xff,
+                         handle & 0xfff)
+
+
+class TcClass(object):
+    """One class of ``tc -s class show``; rates are in bit/s."""
+
+    __slots__ = ('kind', 'handle', 'parent', 'prio', 'rate', 'ceil',
+                 'bytes', 'packets', 'drops', 'overlimits')
+
+    def __init__(self, kind, handle, parent=None, prio=None, rate=None,
+                 ceil=None):
+        self.kind = kind
+        self.handle = handle
+        self.parent = parent
+        self.prio = prio
+        self.rate = rate
+        self.ceil = ceil
+        self.bytes = 0
+        self.packets = 0
+        self.drops = 0
+        self.overlimits = 0
+
+    def __repr__(self):
+        return '<TcClass %s parent %s rate %s>' % (self.handle, self.parent,
+                                                   self.rate)
+
+
+class TcFilter(object):
+    """One u32 filter (or hash table) of ``tc filter show``.
+
+    ``handle`` is the integer u32 handle, ``keys`` a tuple of
+    (value, mask, offset) integers, ``divisor`` is set for hash tables and
+    ``link`` (an integer htid handle) for filters linking to one.
+    """
+
+    __slots__ = ('prio', 'handle', 'divisor', 'link', 'flowid', 'keys',
+                 'hits')
+
+    def __init__(self, prio, handle):
+        self.prio = prio
+        self.handle = handle
+        self.divisor = None
+        self.link = None
+        self.flowid = None
+        self.keys = ()
+        self.hits = None
+
+    def address(self, offset):
+        """Return the dotted /32 address matched at offset, if any."""
+        for value, mask, at in self.keys:
+            if at == offset and mask == 0xffffffff:
+                return socket.inet_ntoa(struct.pack('!I', value))
+        return None
+
+    def __repr__(self):
+        return '<TcFilter %s prio %s flowid %s>' % (
+            format_u32_handle(self.handle), self.prio, self.flowid)
+
+
+def parse_classes(lines):
+    """Yield a :class:`TcClass` per class of ``tc [-s] class show``."""
+    record = None
+    for line in lines:
+        if line.startswith('class '):
+            if record is not None:
+                yield record
+            tokens = line.split()
+            record = TcClass(tokens[1], tokens[2])
+            for index in xrange(3, len(tokens) - 1):
+                token = tokens[index]
+                if token == 'parent':
+                    record.parent = tokens[index + 1]
+                elif token == 'prio':
+                    record.prio = int(tokens[index + 1])
+                elif token == 'rate':
+                    record.rate = parse_rate(tokens[index + 1])
+                elif token == 'ceil':
+                    record.ceil = parse_rate(tokens[index + 1])
+        elif record is not None and line.startswith(' Sent '):
+            # " Sent 42 bytes 1 pkt (dropped 0, overlimits 0 requeues 0)"
+            tokens = line.split()
+            record.bytes = int(tokens[1])
+            record.packets = int(tokens[3])
+            record.drops = int(tokens[6].rstrip(','))
+            record.overlimits = int(tokens[8])
+    if record is not None:
+        yield record
+
+
+def parse_filters(lines):
+    """Yield a :class:`TcFilter` per u32 node of ``tc filter show``.
+
+    The bare 'filter ... u32' lines announcing a filter prio carry no
+    handle and are skipped.
+    """
+    record = None
+    keys = []
+    for line in lines:
+        if line.startswith('filter '):
+            if record is not None:
+                record.keys = tuple(keys)
+                yield record
+                record = None
+            tokens = line.split()
+            try:
+                index = tokens.index('fh')
+            except ValueError:
+                continue
+            record = TcFilter(int(tokens[tokens.index('pref') + 1]),
+                              netlink.parse_u32_handle(tokens[index + 1]))
+            keys = []
+            for index in xrange(index + 2, len(tokens) - 1):
+                token = tokens[index]
+                if token == 'divisor':
+                    record.divisor = int(tokens[index + 1])
+                elif token == 'link':
+                    record.link = netlink.parse_u32_handle(tokens[index + 1])
+                elif token in ('flowid', '*flowid', 'classid',
+                               '*classid'):
+                    record.flowid = tokens[index + 1]
+        elif record is not None:
+            tokens = line.split()
+            if tokens and tokens[0] == 'match' and len(tokens) >= 4:
+                # "  match 0a000105/ffffffff at 12"
+                value, _sep, mask = tokens[1].partition('/')
+                keys.append((int(value, 16), int(mask, 16), int(tokens[3])))
+            elif tokens and tokens[0] == '(rule':
+                # "  (rule hit 12 success 3)"
+                record.hits = int(tokens[2])
+    if record is not None:
+        record.keys = tuple(keys)
+        yield record
+
+
+def show_classes(dev, stats=True):
+    """Yield the classes of dev straight from a tc process."""
+    args = ['tc', '-s', 'class', 'show', 'dev', dev]
+    if not stats:
+        args.remove('-s')
+    return parse_classes(executor.get_executor().execute_lines(
+        *args, run_as_root=True))
+
+
+def show_filters(dev, parent='10:'):
+    """Yield the u32 filters of dev under parent from a tc process."""
+    return parse_filters(executor.get_executor().execute_lines(
+        'tc', 'filter', 'show', 'dev', dev, 'parent', parent,
+        run_as_root=True))
@@ -19,6 +19,7 @@
 
 """Utilities and helper functions."""
 
+import collections
 import contextlib
 import datetime
 import errno
@@ -44,7 +45,9 @@ from xml.sax import saxutils
 from eventlet import event
 from eventlet.green import subprocess
 from eventlet import greenthread
+from eventlet import hubs
 from eventlet import semaphore
+from eventlet import timeout as eventlet_timeout
 import netaddr
 from traffic.openstack.common.gettextutils import _
 
@@ -56,6 +59,7 @@ from traffic.openstack.common import excutils
 from traffic.openstack.common import importutils
 from traffic.openstack.common import log as logging
 from traffic.openstack.common import timeutils
+from traffic.rootwrap import client as rootwrap_client
 
 
 LOG = logging.getLogger(__name__)
@@ -138,7 +142,12 @@ def execute(*cmd, **kwargs):
     :param attempts:           How many times to retry cmd.
     :param run_as_root:        True | False. Defaults to False. If set to True,
                                the command is prefixed by the command specified
-                               in the root_helper FLAG.
+                               in the root_helper FLAG, or sent to the rootwrap
+                               daemon if use_rootwrap_daemon is set.
+    :param timeout:            Seconds after which the command is killed and
+                               exception.ProcessExecutionTimeout raised,
+                               whatever check_exit_code is.  Defaults to
+                               None, waiting forever.
 
     :raises exception.TrafficException: on receiving unknown arguments
     :raises exception.ProcessExecutionError:
@@ -158,12 +167,14 @@ def execute(*cmd, **kwargs):
     attempts = kwargs.pop('attempts', 1)
     run_as_root = kwargs.pop('run_as_root', False)
     shell = kwargs.pop('shell', False)
+    timeout = kwargs.pop('timeout', None)
 
     if len(kwargs):
         raise exception.TrafficException(_('Got unknown keyword args '
                                         'to utils.execute: %r') % kwargs)
 
-    if run_as_root:
+    use_daemon = run_as_root and _use_rootwrap_daemon()
+    if run_as_root and not use_daemon:
 
         if FLAGS.rootwrap_config is None or FLAGS.root_helper != 'sudo':
             deprecated.warn(_('The root_helper option (which lets you specify '
@@ -172,31 +183,49 @@ def execute(*cmd, **kwargs):
                               'You should use the rootwrap_config option '
                               'instead.'))
 
-        if (FLAGS.rootwrap_config is not None):
-            cmd = ['sudo', 'traffic-rootwrap', FLAGS.rootwrap_config] + list(cmd)
-        else:
-            cmd = shlex.split(FLAGS.root_helper) + list(cmd)
+        cmd = _root_helper_cmd(cmd)
     cmd = map(str, cmd)
 
     while attempts > 0:
         attempts -= 1
         try:
-            LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
-            _PIPE = subprocess.PIPE  # pylint: disable=E1101
-            obj = subprocess.Popen(cmd,
-                                   stdin=_PIPE,
-                                   stdout=_PIPE,
-                                   stderr=_PIPE,
-                                   close_fds=True,
-                                   preexec_fn=_subprocess_setup,
-                                   shell=shell)
-            result = None
-            if process_input is not None:
-                result = obj.communicate(process_input)
+            if use_daemon:
+                LOG.debug(_('Running cmd (rootwrap daemon): %s'),
+                          ' '.join(cmd))
+                _returncode, stdout, stderr = \
+                    rootwrap_client.get_client().execute(cmd, process_input,
+                                                         timeout=timeout)
+                result = (stdout, stderr)
             else:
-                result = obj.communicate()
-            obj.stdin.close()  # pylint: disable=E1101
-            _returncode = obj.returncode  # pylint: disable=E1101
+                LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
+                _PIPE = subprocess.PIPE  # pylint: disable=E1101
+                obj = subprocess.Popen(cmd,
+                                       stdin=_PIPE,
+                                       stdout=_PIPE,
+                                       stderr=_PIPE,
+                                       close_fds=True,
+                                       preexec_fn=_subprocess_setup,
+                                       shell=shell)
+                result = None
+                timer = eventlet_timeout.Timeout(timeout)
+                try:
+                    if process_input is not None:
+                        result = obj.communicate(process_input)
+                    else:
+                        result = obj.communicate()
+                except eventlet_timeout.Timeout, e:
+                    if e is not timer:
+                        raise
+                    obj.kill()
+                    obj.wait()
+                    raise exception.ProcessExecutionTimeout(
+                            timeout,
+                            exit_code=obj.returncode,
+                            cmd=' '.join(cmd))
+                finally:
+                    timer.cancel()
+                obj.stdin.close()  # pylint: disable=E1101
+                _returncode = obj.returncode  # pylint: disable=E1101
             LOG.debug(_('Result was %s') % _returncode)
             if not ignore_exit_code and _returncode not in check_exit_code:
                 (stdout, stderr) = result
@@ -221,6 +250,113 @@ def execute(*cmd, **kwargs):
             greenthread.sleep(0)
 
 
+def _use_rootwrap_daemon():
+    return FLAGS.use_rootwrap_daemon and FLAGS.rootwrap_config is not None
+
+
+def _root_helper_cmd(cmd):
+    if (FLAGS.rootwrap_config is not None):
+        return ['sudo', 'traffic-rootwrap', FLAGS.rootwrap_config] + list(cmd)
+    return shlex.split(FLAGS.root_helper) + list(cmd)
+
+
+def execute_lines(*cmd, **kwargs):
+    """Run a command and yield its stdout line by line.
+
+    Unlike execute() the output is never held in memory as a whole, which
+    suits commands dumping large tables.  stderr is discarded and the exit
+    code is only logged.
+
+    :param run_as_root: True | False. Defaults to False. If set to True,
+                        the command is run through the root helper, or by
+                        the rootwrap daemon if use_rootwrap_daemon is set;
+                        the daemon returns the output in one piece.
+    :param timeout:     Seconds after which the command is killed and
+                        exception.ProcessExecutionTimeout raised once the
+                        lines read so far are consumed.  Defaults to None.
+    """
+    timeout = kwargs.get('timeout')
+    if kwargs.get('run_as_root', False) and _use_rootwrap_daemon():
+        cmd = map(str, cmd)
+        LOG.debug(_('Running cmd (rootwrap daemon): %s'), ' '.join(cmd))
+        code, out, _err = rootwrap_client.get_client().execute(
+            cmd, timeout=timeout)
+        if code:
+            LOG.debug(_('%(cmd)s returned %(code)s'),
+                      {'cmd': ' '.join(cmd), 'code': code})
+        for line in out.splitlines(True):
+            yield line
+        return
+    if kwargs.get('run_as_root', False):
+        cmd = _root_helper_cmd(cmd)
+    cmd = map(str, cmd)
+    LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
+    with open(os.devnull, 'w') as devnull:
+        obj = subprocess.Popen(cmd,
+                               stdout=subprocess.PIPE,
+                               stderr=devnull,
+                               close_fds=True,
+                               preexec_fn=_subprocess_setup)
+    deadline = None
+    if timeout:
+        deadline = time.time() + timeout
+    try:
+        for line in _read_lines(obj.stdout.fileno(), deadline):
+            yield line
+    except _ReadTimeout:
+        try:
+            obj.kill()
+        except OSError:
+            pass
+        raise exception.ProcessExecutionTimeout(timeout, cmd=' '.join(cmd))
+    finally:
+        obj.stdout.close()
+        if obj.wait():
+            LOG.debug(_('%(cmd)s returned %(code)s'),
+                      {'cmd': ' '.join(cmd), 'code': obj.returncode})
+
+
+class _ReadTimeout(Exception):
+    pass
+
+
+def _read_lines(fd, deadline=None):
+    """Yield the lines of a non-blocking fd until EOF.
+
+    Raises _ReadTimeout if the fd is still open at deadline, even if the
+    process writing to it is gone but one of its children holds it.
+    """
+    pending = ''
+    while True:
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise _ReadTimeout()
+        # wait here rather than in os.read, which is green and waits
+        # forever once monkey patched
+        hubs.trampoline(fd, read=True, timeout=remaining,
+                        timeout_exc=_ReadTimeout)
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+            continue
+        if not chunk:
+            break
+        data = pending + chunk
+        start = 0
+        end = data.find('\n')
+        while end >= 0:
+            yield data[start:end + 1]
+            start = end + 1
+            end = data.find('\n', start)
+        pending = data[start:]
+    if pending:
+        yield pending
+
+
 def trycmd(*args, **kwargs):
     """
     A wrapper around execute() to more easily handle warnings and errors.
@@ -569,6 +705,59 @@ class LoopingCall(object):
         return self.done.wait()
 
 
+class LRUCache(object):
+    """A mapping of at most maxsize entries, least recently used first out.
+
+    Entries older than ttl seconds, when a ttl is given, count as missing.
+    Lookups are counted in hits and misses.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None or (self.ttl and time.time() - entry[0] > self.ttl):
+            self.misses += 1
+            return default
+        # re-inserted as the most recently used
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time(), value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def items(self):
+        return [(key, entry[1]) for key, entry in self._entries.iteritems()]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses}
+
+
 def xhtml_escape(value):
     """Escapes a string so it is valid within XML or XHTML.
 
@@ -766,6 +955,72 @@ def synchronized(name, external=False, lock_path=None):
     return wrap
 
 
+class KeyedLock(object):
+    """One lock per key, for many keys held by green threads.
+
+    A key only takes memory while it is held, so the locks are bounded by
+    the operations in flight rather than by the keys ever seen.  Threads
+    waiting for a key get it in the order they asked for it::
+
+        locks = KeyedLock()
+        with locks.lock(instance_uuid):
+            ...
+    """
+
+    def __init__(self):
+        # key -> events of the threads waiting for it, while it is held
+        self._waiters = {}
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def waiting(self):
+        """Return how many threads wait for a key held by another."""
+        return sum(len(waiters) for waiters in self._waiters.itervalues())
+
+    def _acquire(self, key):
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            self._waiters[key] = collections.deque()
+            return
+        waiter = event.Event()
+        waiters.append(waiter)
+        try:
+            waiter.wait()
+        except BaseException:
+            if waiter.ready():
+                # it was handed over just before this thread was killed
+                self._release(key)
+            else:
+                waiters.remove(waiter)
+            raise
+
+    def _release(self, key):
+        waiters = self._waiters[key]
+        if waiters:
+            waiters.popleft().send()
+        else:
+            del self._waiters[key]
+
+    @contextlib.contextmanager
+    def lock(self, *keys):
+        """Hold every key while the block runs.
+
+        The keys are taken in sorted order so that threads locking several
+        keys at once can not deadlock.
+        """
+        keys = sorted(set(keys))
+        held = []
+        try:
+            for key in keys:
+                self._acquire(key)
+                held.append(key)
+            yield
+        finally:
+            for key in reversed(held):
+                self._release(key)
+
+
 def delete_if_exists(pathname):
     """delete a file, but ignore file not found error"""
 